@@ -2,20 +2,46 @@ from __future__ import annotations
 
 import datetime as dt
 import gzip
+import io
+import json
+import os
+import random
 import time
+import zlib
 from dataclasses import dataclass
-from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 import threading
 from dataclasses import field
-from typing import Callable, Optional
+from typing import Any, Callable, Iterable, Iterator, Optional
 
 from botocore.exceptions import ClientError
+from googleapiclient.errors import HttpError
 
 from .config import R2Config
-from .gmail import GmailClient
+from .gmail import AdaptiveLimiter, GmailClient
+from .naming import message_key_match
 from .r2 import R2Client
 from .state import StateStore
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore[assignment]
+
+
+# Compression codec -> (object key suffix, Content-Type). Keys must stay in sync
+# with the suffix handling in restore.py and the rehydrate-index command.
+COMPRESSION_SUFFIXES: dict[str, str] = {
+    "gzip": ".eml.gz",
+    "zstd": ".eml.zst",
+    "none": ".eml",
+}
+COMPRESSION_CONTENT_TYPES: dict[str, str] = {
+    "gzip": "application/gzip",
+    "zstd": "application/zstd",
+    "none": "message/rfc822",
+}
+
 
 @dataclass
 class BackupStats:
@@ -25,26 +51,111 @@ class BackupStats:
     error_samples: list[str] = field(default_factory=list)
 
 
+def _probably_incompressible(raw: bytes) -> bool:
+    # Cheap probe: deflate the first 4 KiB at level 1. Bodies dominated by
+    # already-compressed attachments barely shrink, so storing them raw saves
+    # the full-buffer compression for ~zero size cost.
+    probe = raw[:4096]
+    if len(probe) < 1024:
+        return False
+    return len(zlib.compress(probe, 1)) > len(probe) * 0.95
+
+
+def _chunks(ids: Iterable[str], size: int) -> Iterator[list[str]]:
+    buf: list[str] = []
+    for mid in ids:
+        buf.append(mid)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+# Keep output safe/sanitized: no secrets, no message bodies.
+# HttpError content may include request/response details; keep it minimal.
+def _client_error_summary(exc: Exception) -> str:
+    code = ((getattr(exc, "response", None) or {}).get("Error") or {}).get("Code")
+    return f"ClientError(code={code})"
+
+
+def _http_error_summary(exc: Exception) -> str:
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    return f"HttpError(status={status})"
+
+
+_SUMMARY_TABLE: dict[type, Callable[[Exception], str]] = {
+    ClientError: _client_error_summary,
+    HttpError: _http_error_summary,
+}
+
+
 def _error_summary(exc: Exception) -> str:
-    # Keep output safe/sanitized: no secrets, no message bodies.
+    handler = _SUMMARY_TABLE.get(type(exc))
+    if handler is not None:
+        return handler(exc)
+    # botocore raises per-code ClientError subclasses, so fall back to an
+    # isinstance check when the exact-type lookup misses.
     if isinstance(exc, ClientError):
-        code = ((exc.response or {}).get("Error") or {}).get("Code")
-        return f"ClientError(code={code})"
-    # HttpError content may include request/response details; keep it minimal.
-    if type(exc).__name__ == "HttpError":
-        status = getattr(getattr(exc, "resp", None), "status", None)
-        return f"HttpError(status={status})"
+        return _client_error_summary(exc)
     return exc.__class__.__name__
 
 
 class BackupRunner:
-    def __init__(self, gmail: GmailClient, r2: R2Config, state: StateStore, *, gzip_level: int = 6):
+    def __init__(
+        self,
+        gmail: GmailClient,
+        r2: R2Config,
+        state: StateStore,
+        *,
+        gzip_level: int = 1,
+        compression: str = "gzip",
+        fused: bool = False,
+    ):
         self._gmail = gmail
         self._r2cfg = r2
         self._state = state
         self._r2 = R2Client(r2)
         self._worker_local = threading.local()
         self._gzip_level = int(gzip_level)
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression codec: {compression!r}")
+        if compression == "zstd" and zstandard is None:
+            raise SystemExit("Compression 'zstd' requires the 'zstandard' package (pip install zstandard).")
+        self._compression = compression
+        self._suffix = COMPRESSION_SUFFIXES[compression]
+        self._content_type = COMPRESSION_CONTENT_TYPES[compression]
+        self._fused = bool(fused)
+        # Negative-lookup shortcut for claim_upload: ids known to be uploaded.
+        # Plain set membership/add are atomic under the GIL, which is all the
+        # worker threads need here (a stale miss just falls through to SQLite).
+        self._already_uploaded: set[str] = set()
+        self._compress = self._make_compressor()
+        # Small helper pool so the per-message meta PUT overlaps the body PUT
+        # instead of adding a second serial round-trip per message.
+        self._meta_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="r2-meta")
+        # Compression is CPU-bound; cap it at physical core count so a large
+        # --workers value keeps saturating the network instead of thrashing
+        # the CPU (zstd/zlib release the GIL while compressing).
+        self._compress_pool = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 2, thread_name_prefix="compress"
+        )
+        # Upload stage pool; sized per run (workers*2) so R2 PUTs overlap the
+        # Gmail fetches running on the chunk workers.
+        self._upload_pool: Optional[ThreadPoolExecutor] = None
+        # Re-sized to --workers per run; backs off when Gmail throttles.
+        self._gmail_limiter = AdaptiveLimiter(1)
+
+    def _make_compressor(self) -> Callable[[bytes], bytes]:
+        if self._compression == "none":
+            return lambda raw: raw
+        if self._compression == "zstd":
+            # zstd level 3 ~ gzip ratio at several times the throughput; the
+            # compressor object is thread-safe for one-shot compress() calls.
+            cctx = zstandard.ZstdCompressor(level=self._gzip_level)
+            return cctx.compress
+        level = self._gzip_level
+        return lambda raw: gzip.compress(raw, compresslevel=level)
 
     def _gmail_worker(self) -> GmailClient:
         # googleapiclient service objects are not guaranteed thread-safe.
@@ -55,24 +166,130 @@ class BackupRunner:
             self._worker_local.gmail = c
         return c
 
+    def _r2_worker(self) -> R2Client:
+        # One boto3 client (and thus one HTTPS connection pool) per worker
+        # thread, so concurrent uploads don't contend on a shared pool.
+        c = getattr(self._worker_local, "r2", None)
+        if c is None:
+            c = R2Client(self._r2cfg)
+            self._worker_local.r2 = c
+        return c
+
     def _gmail_query_since(self, since: dt.date) -> str:
         # Gmail query supports after:YYYY/MM/DD (interpreted in account timezone).
         return f"after:{since.strftime('%Y/%m/%d')}"
 
-    def _upload_message(self, message_id: str) -> bool:
-        # Claim first for concurrency safety; release claim on exit.
-        if not self._state.claim_upload(message_id):
-            return False
-        try:
-            raw, meta = self._gmail_worker().get_message_raw(message_id)
-            raw_gz = gzip.compress(raw, compresslevel=self._gzip_level)
+    def _backup_batch(self, message_ids: list[str]) -> tuple[int, int, list[tuple[str, Exception]]]:
+        """
+        Claim, batch-fetch, compress and upload a chunk of message ids.
 
-            self._r2.put_bytes(f"messages/{message_id}.eml.gz", raw_gz, content_type="application/gzip")
-            self._r2.put_json(f"messages/{message_id}.json", meta)
-            self._state.mark_uploaded(message_id)
-            return True
+        One Gmail batch HTTP call replaces one messages.get round-trip per
+        message. Returns (uploaded, skipped, per-message errors) for the chunk.
+        """
+        uploaded = 0
+        errors: list[tuple[str, Exception]] = []
+        uploaded_mids: list[str] = []
+        # Claim first for concurrency safety; release claims on exit. One
+        # transaction claims the whole chunk instead of one fsync per id.
+        candidates = [mid for mid in message_ids if mid not in self._already_uploaded]
+        claimed = self._state.bulk_claim_upload(candidates)
+        skipped = len(message_ids) - len(claimed)
+        try:
+            self._gmail_limiter.acquire()
+            throttled = False
+            try:
+                results, fetch_errors = self._gmail_worker().get_messages_raw_batch(claimed)
+                throttled = any(GmailClient.is_rate_limit_error(e) for e in fetch_errors.values())
+            except Exception as exc:
+                throttled = GmailClient.is_rate_limit_error(exc)
+                errors.extend((mid, exc) for mid in claimed)
+                return uploaded, skipped, errors
+            finally:
+                self._gmail_limiter.release(throttled=throttled)
+            errors.extend(fetch_errors.items())
+            pool = self._upload_pool
+            if pool is None:
+                for mid, (raw, meta) in results.items():
+                    try:
+                        self._upload_one(mid, raw, meta)
+                        uploaded_mids.append(mid)
+                        uploaded += 1
+                    except Exception as exc:
+                        errors.append((mid, exc))
+            else:
+                # Fan the chunk's uploads out so PUT latencies overlap instead
+                # of being paid serially on this fetch thread.
+                futs = {
+                    pool.submit(self._upload_one, mid, raw, meta): mid
+                    for mid, (raw, meta) in results.items()
+                }
+                for fut in as_completed(futs):
+                    fut_mid = futs[fut]
+                    try:
+                        fut.result()
+                        uploaded_mids.append(fut_mid)
+                        uploaded += 1
+                    except Exception as exc:
+                        errors.append((fut_mid, exc))
         finally:
-            self._state.release_upload_claim(message_id)
+            # One transaction per chunk instead of 2 state writes per message;
+            # one timestamp per chunk instead of one clock read per row.
+            now = int(time.time())
+            self._state.finalize_uploads([(mid, now) for mid in uploaded_mids], claimed)
+            self._already_uploaded.update(uploaded_mids)
+        return uploaded, skipped, errors
+
+    def _stream_compress_into(self, raw: bytes, fileobj: Any) -> None:
+        if self._compression == "zstd":
+            zstandard.ZstdCompressor(level=self._gzip_level).copy_stream(io.BytesIO(raw), fileobj)
+        else:
+            with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self._gzip_level) as gz:
+                gz.write(raw)
+
+    def _upload_one(self, mid: str, raw: bytes, meta: dict[str, object]) -> None:
+        skip_compress = self._compression == "none" or _probably_incompressible(raw)
+        suffix = ".eml" if skip_compress else self._suffix
+        content_type = "message/rfc822" if skip_compress else self._content_type
+        if not self._fused and not skip_compress and len(raw) > R2Client.MULTIPART_THRESHOLD:
+            # Large message: stream-compress straight into a multipart upload so
+            # peak memory stays O(part size) instead of raw + compressed copies.
+            meta_key = f"messages/{mid}.json"
+            meta_fut = self._meta_pool.submit(lambda: self._r2_worker().put_json(meta_key, meta))
+            with self._r2_worker().open_streaming_writer(
+                f"messages/{mid}{suffix}", content_type=content_type
+            ) as w:
+                self._stream_compress_into(raw, w)
+            meta_fut.result()
+            return
+        body = raw if skip_compress else self._compress_pool.submit(self._compress, raw).result()
+        if self._fused:
+            # One object, one PUT: raw body + meta packed into a tar.
+            meta_bytes = json.dumps(meta, indent=2, sort_keys=True).encode("utf-8")
+            self._r2_worker().put_tar(
+                f"messages/{mid}.tar",
+                [(f"raw{suffix}", body), ("meta.json", meta_bytes)],
+            )
+        else:
+            meta_key = f"messages/{mid}.json"
+            meta_fut = self._meta_pool.submit(lambda: self._r2_worker().put_json(meta_key, meta))
+            self._r2_worker().put_bytes(f"messages/{mid}{suffix}", body, content_type=content_type)
+            meta_fut.result()
+
+    def _seed_uploaded_index_from_r2(self) -> None:
+        """
+        Fresh-machine fast path: if the local uploaded index is empty but R2
+        already holds messages, one LIST sweep (a request per 1000 objects)
+        backfills the index instead of re-uploading the whole mailbox.
+        """
+        now = int(time.time())
+        rows: list[tuple[str, int]] = []
+        for obj in self._r2.iter_objects("messages/"):
+            m = message_key_match(obj.key)
+            if m:
+                rows.append((m.group(1), obj.last_modified_at or now))
+        if rows:
+            self._state.bulk_mark_uploaded(rows)
+            self._already_uploaded.update(mid for mid, _ in rows)
 
     def _persist_state_to_r2(self) -> None:
         st = self._state.read_state()
@@ -83,7 +300,7 @@ class BackupRunner:
         if local:
             return
         remote = self._r2.get_json_or_none("state/state.json")
-        if remote:
+        if isinstance(remote, dict):
             self._state.write_state(remote)
 
     def run_backup(
@@ -93,9 +310,17 @@ class BackupRunner:
         *,
         workers: int = 1,
         progress_every: int = 0,
+        label_id: Optional[str] = None,
         on_progress: Optional[Callable[[str, int, BackupStats, float], None]] = None,
     ) -> BackupStats:
+        # Pay the R2 DNS/TLS setup once up front instead of on each worker's
+        # first PUT. (The Gmail token is refreshed in from_stored_token, so
+        # worker clones already start with a fresh token.)
+        self._r2.prewarm()
         self._bootstrap_state_from_r2_if_needed()
+        self._already_uploaded = self._state.uploaded_ids()
+        if not self._already_uploaded:
+            self._seed_uploaded_index_from_r2()
         stats = BackupStats()
         started = time.monotonic()
         last_report_n = 0
@@ -106,130 +331,125 @@ class BackupRunner:
             stats.errors += 1
             if len(stats.error_samples) < max_error_samples:
                 stats.error_samples.append(f"{mid}: {_error_summary(exc)}")
+                return
+            # Reservoir sampling: keep a uniform sample over the whole run and
+            # only pay the summary/format cost for errors that are kept.
+            j = random.randrange(stats.errors)
+            if j < max_error_samples:
+                stats.error_samples[j] = f"{mid}: {_error_summary(exc)}"
+
+        # Resolve the callback once so the per-batch hot path pays a single None
+        # check, and time.monotonic() runs only when a report actually fires.
+        report_cb = on_progress if progress_every else None
+        checkpoint_every = 512
+        next_checkpoint = checkpoint_every
+
+        def apply_batch(phase: str, result: tuple[int, int, list[tuple[str, Exception]]]) -> None:
+            nonlocal last_report_n
+            nonlocal next_checkpoint
+            up, sk, errs = result
+            stats.uploaded += up
+            stats.skipped += sk
+            for mid, exc in errs:
+                record_error(mid, exc)
+            n = stats.uploaded + stats.skipped + stats.errors
+            if n >= next_checkpoint:
+                # Periodic off-thread checkpoint so a crash mid-run doesn't
+                # lose all progress accumulated in the local state log.
+                next_checkpoint = n + checkpoint_every
+                self._meta_pool.submit(self._persist_state_to_r2)
+                self._state.checkpoint_truncate()
+            if report_cb is not None and n - last_report_n >= progress_every:
+                last_report_n = n
+                report_cb(phase, n, stats, time.monotonic() - started)
+
+        def process_ids(ids: Iterable[str], phase: str, ex: Optional[ThreadPoolExecutor]) -> None:
+            # Fetch in Gmail-batch-sized chunks; one worker task per chunk.
+            chunks = _chunks(ids, GmailClient.BATCH_GET_SIZE)
+            if ex is None:
+                for chunk in chunks:
+                    apply_batch(phase, self._backup_batch(chunk))
+                return
+            # Bound in-flight chunks so we don't enumerate far ahead of uploads.
+            pending: set[Future[tuple[int, int, list[tuple[str, Exception]]]]] = set()
+            max_pending = max(int(workers) * 2, 2)
+            for chunk in chunks:
+                pending.add(ex.submit(self._backup_batch, chunk))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        apply_batch(phase, f.result())
+            for f in as_completed(pending):
+                apply_batch(phase, f.result())
 
         state = self._state.read_state()
         start_history_id = state.get("historyId")
         full_scan_complete = bool(state.get("fullScanComplete"))
 
-        # Prefer incremental history-based backup when possible.
-        #
-        # Safety: don't use history mode until we have *some* uploaded index locally.
-        # A fresh (or accidentally copied) state.json could contain historyId/fullScanComplete
-        # that would otherwise make us skip the initial full scan.
-        used_history = False
-        if start_history_id and full_scan_complete and self._state.has_uploaded_any():
-            try:
-                for ids, latest_hid in self._gmail.history_message_added_paged(
-                    start_history_id=str(start_history_id),
-                    max_results=max_messages or 0,
-                ):
-                    used_history = True
-                    if workers <= 1:
-                        mids = ids
-                        for mid in mids:
-                            try:
-                                if self._upload_message(mid):
-                                    stats.uploaded += 1
-                                else:
-                                    stats.skipped += 1
-                            except Exception as exc:
-                                record_error(mid, exc)
-                            if progress_every and on_progress:
-                                n = stats.uploaded + stats.skipped + stats.errors
-                                if n and (n % progress_every == 0) and n != last_report_n:
-                                    last_report_n = n
-                                    on_progress("history", n, stats, time.monotonic() - started)
+        executor = ThreadPoolExecutor(max_workers=int(workers)) if workers > 1 else None
+        self._gmail_limiter = AdaptiveLimiter(int(workers))
+        self._upload_pool = ThreadPoolExecutor(
+            max_workers=max(int(workers) * 2, 8), thread_name_prefix="upload"
+        )
+        try:
+            # Prefer incremental history-based backup when possible.
+            #
+            # Safety: don't use history mode until we have *some* uploaded index locally.
+            # A fresh (or accidentally copied) state.json could contain historyId/fullScanComplete
+            # that would otherwise make us skip the initial full scan.
+            used_history = False
+            if start_history_id and full_scan_complete and self._state.has_uploaded_any():
+                try:
+                    last_hid: str | None = None
+                    for ids, latest_hid in self._gmail.history_message_added_paged(
+                        start_history_id=str(start_history_id),
+                        max_results=max_messages or 0,
+                        label_id=label_id,
+                    ):
+                        used_history = True
+                        process_ids(ids, "history", executor)
+                        if latest_hid:
+                            last_hid = latest_hid
+                            # Cheap append keeps per-page progress crash-safe
+                            # without rewriting state.json each page.
+                            self._state.append_log({"historyId": latest_hid})
+                    # One state.json rewrite per run, not per history page. Only
+                    # advance on clean completion so a failed run re-reads from
+                    # the old historyId.
+                    if last_hid:
+                        self._state.write_state({"historyId": last_hid})
+                except Exception as e:
+                    if GmailClient.is_history_too_old(e):
+                        used_history = False
                     else:
-                        with ThreadPoolExecutor(max_workers=int(workers)) as ex:
-                            futs = {ex.submit(self._upload_message, mid): mid for mid in ids}
-                            for fut in as_completed(futs):
-                                mid = futs[fut]
-                                try:
-                                    if fut.result():
-                                        stats.uploaded += 1
-                                    else:
-                                        stats.skipped += 1
-                                except Exception as exc:
-                                    record_error(mid, exc)
-                                if progress_every and on_progress:
-                                    n = stats.uploaded + stats.skipped + stats.errors
-                                    if n and (n % progress_every == 0) and n != last_report_n:
-                                        last_report_n = n
-                                        on_progress("history", n, stats, time.monotonic() - started)
-                    if latest_hid:
-                        self._state.write_state({"historyId": latest_hid})
-            except Exception as e:
-                if GmailClient.is_history_too_old(e):
-                    used_history = False
-                else:
-                    raise
-
-        if not used_history:
-            # Fallback scan: query-based list. (Used on first run or if history is too old.)
-            q = self._gmail_query_since(since) if since else None
-            if workers <= 1:
-                for mid in self._gmail.list_messages(q=q, max_results=max_messages or 0):
-                    listed += 1
-                    try:
-                        if self._upload_message(mid):
-                            stats.uploaded += 1
-                        else:
-                            stats.skipped += 1
-                    except Exception as exc:
-                        record_error(mid, exc)
-                    if progress_every and on_progress:
-                        n = stats.uploaded + stats.skipped + stats.errors
-                        if n and (n % progress_every == 0) and n != last_report_n:
-                            last_report_n = n
-                            on_progress("scan", n, stats, time.monotonic() - started)
-            else:
-                # Producer/consumer: submit as we enumerate IDs to avoid loading all IDs in memory.
-                with ThreadPoolExecutor(max_workers=int(workers)) as ex:
-                    pending: dict[Future[bool], str] = {}
+                        raise
+
+            if not used_history:
+                # Fallback scan: query-based list. (Used on first run or if history is too old.)
+                q = self._gmail_query_since(since) if since else None
+
+                def _listed_ids() -> Iterator[str]:
+                    nonlocal listed
                     for mid in self._gmail.list_messages(q=q, max_results=max_messages or 0):
                         listed += 1
-                        fut = ex.submit(self._upload_message, mid)
-                        pending[fut] = mid
-                        if len(pending) >= int(workers) * 4:
-                            done = [f for f in list(pending.keys()) if f.done()]
-                            for f in done:
-                                f_mid = pending.pop(f, "?")
-                                try:
-                                    if f.result():
-                                        stats.uploaded += 1
-                                    else:
-                                        stats.skipped += 1
-                                except Exception as exc:
-                                    record_error(f_mid, exc)
-                                if progress_every and on_progress:
-                                    n = stats.uploaded + stats.skipped + stats.errors
-                                    if n and (n % progress_every == 0) and n != last_report_n:
-                                        last_report_n = n
-                                        on_progress("scan", n, stats, time.monotonic() - started)
-                    for f in as_completed(list(pending.keys())):
-                        f_mid = pending.get(f, "?")
-                        try:
-                            if f.result():
-                                stats.uploaded += 1
-                            else:
-                                stats.skipped += 1
-                        except Exception as exc:
-                            record_error(f_mid, exc)
-                        if progress_every and on_progress:
-                            n = stats.uploaded + stats.skipped + stats.errors
-                            if n and (n % progress_every == 0) and n != last_report_n:
-                                last_report_n = n
-                                on_progress("scan", n, stats, time.monotonic() - started)
-
-            # If the scan was capped, keep scanning on future runs (do not switch to history-based incrementals yet).
-            scan_capped = bool(max_messages) and listed >= int(max_messages)
-            self._state.write_state({"fullScanComplete": not scan_capped})
-
-            if not scan_capped:
-                # Update historyId to current after scan so next run can be incremental.
-                profile = self._gmail.get_profile()
-                if profile.get("historyId"):
-                    self._state.write_state({"historyId": profile.get("historyId")})
+                        yield mid
+
+                process_ids(_listed_ids(), "scan", executor)
+
+                # If the scan was capped, keep scanning on future runs (do not switch to history-based incrementals yet).
+                scan_capped = bool(max_messages) and listed >= int(max_messages)
+                self._state.write_state({"fullScanComplete": not scan_capped})
+
+                if not scan_capped:
+                    # Update historyId to current after scan so next run can be incremental.
+                    profile = self._gmail.get_profile()
+                    if profile.get("historyId"):
+                        self._state.write_state({"historyId": profile.get("historyId")})
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self._upload_pool.shutdown(wait=True)
+            self._upload_pool = None
 
         self._state.write_state({"lastRunAt": int(time.time())})
         self._persist_state_to_r2()
@@ -1,23 +1,25 @@
 from __future__ import annotations
 
 import datetime as dt
+import functools
 import os
 import sys
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Iterator, Optional
 
 import typer
 
 from .config import AppConfig, R2Config, load_app_config
-from .gmail import GmailClient
-from .backup import BackupRunner
-from .backup import BackupStats
-from .r2 import R2Client
-from .restore import RestoreRunner
-from .restore import RestoreStats
 from .state import StateStore
-from .naming import r2_prefix_from_email
+from .naming import message_key_match, r2_prefix_from_email
+
+if TYPE_CHECKING:
+    # Heavy modules (googleapiclient, boto3) are imported lazily inside the
+    # command bodies so `--help` and argument errors don't pay their import
+    # cost; these names are only needed for annotations.
+    from .gmail import GmailClient
 
 
 app = typer.Typer(
@@ -27,7 +29,32 @@ app = typer.Typer(
 )
 
 
+# Progress is a heartbeat, not a log: cap emission to one line per second and
+# write each line with a single stderr syscall, so a small --progress-every on
+# a fast run can't turn the printer into measurable overhead.
+_PROGRESS_MIN_INTERVAL_S = 1.0
+_progress_last_emit = 0.0
+
+
+def _emit_progress(phase: str, n: int, stats: object, elapsed_s: float) -> None:
+    global _progress_last_emit
+    mono = time.monotonic()
+    if mono - _progress_last_emit < _PROGRESS_MIN_INTERVAL_S:
+        return
+    _progress_last_emit = mono
+    rate = n / elapsed_s if elapsed_s > 0 else 0.0
+    parts = [f"[{phase}] processed={n} rate={rate:.1f}/s"]
+    for name in ("uploaded", "restored", "skipped", "errors"):
+        v = getattr(stats, name, None)
+        if v is not None:
+            parts.append(f"{name}={v}")
+    sys.stderr.write(" ".join(parts) + "\n")
+
+
+@functools.lru_cache(maxsize=8)
 def _parse_since(s: Optional[str]) -> Optional[dt.date]:
+    # Cached: callers may re-parse the same --since value repeatedly (the
+    # daemon parses once up front, but nothing should pay twice regardless).
     if not s:
         return None
     try:
@@ -36,8 +63,17 @@ def _parse_since(s: Optional[str]) -> Optional[dt.date]:
         raise typer.BadParameter("Expected YYYY-MM-DD") from e
 
 
+_DOTENV_LOADED = False
+
+
 def _load_dotenv() -> None:
     # Convenience for local usage. Does not override existing environment by default.
+    # Loaded once per process: main() and every command call this, and the daemon
+    # would otherwise re-read .env from disk on every tick.
+    global _DOTENV_LOADED
+    if _DOTENV_LOADED:
+        return
+    _DOTENV_LOADED = True
     try:
         from dotenv import load_dotenv
 
@@ -65,16 +101,26 @@ def _maybe_auto_prefix(
     gmail: GmailClient,
     enabled: bool,
     explicit: bool,
+    state_obj: Optional[dict[str, Any]] = None,
 ) -> R2Config:
     if not enabled or explicit:
         return r2cfg
-    email = state.read_state().get("emailAddress")
+    if state_obj is None:
+        state_obj = state.read_state()
+    # Resolved once (usually at auth time) and persisted, so steady-state runs
+    # don't need a getProfile round trip just to decide the prefix.
+    prefix = state_obj.get("resolvedPrefix")
+    if isinstance(prefix, str) and prefix:
+        return r2cfg.model_copy(update={"prefix": prefix})
+    email = state_obj.get("emailAddress")
     if not isinstance(email, str) or not email:
         profile = gmail.get_profile()
         email = profile.get("emailAddress")
     if not isinstance(email, str) or not email:
         return r2cfg
-    return r2cfg.model_copy(update={"prefix": r2_prefix_from_email(email)})
+    prefix = r2_prefix_from_email(email)
+    state.write_state({"resolvedPrefix": prefix})
+    return r2cfg.model_copy(update={"prefix": prefix})
 
 def _open_state(state_dir: Optional[Path]) -> StateStore:
     if state_dir:
@@ -113,6 +159,8 @@ def auth(
     ),
 ) -> None:
     _load_dotenv()
+    from .gmail import GmailClient
+
     if credentials and (client_id or client_secret):
         raise typer.BadParameter("Use either --credentials OR --client-id/--client-secret (not both).")
     if not credentials and (not client_id or not client_secret):
@@ -137,10 +185,14 @@ def auth(
     )
     # Touch the profile to validate token and capture current history id for later runs.
     profile = gmail.get_profile()
+    email = profile.get("emailAddress")
     st.write_state(
         {
             "historyId": profile.get("historyId"),
-            "emailAddress": profile.get("emailAddress"),
+            "emailAddress": email,
+            # Resolve the auto prefix now so later commands don't need a
+            # getProfile call to derive it (see _maybe_auto_prefix).
+            "resolvedPrefix": r2_prefix_from_email(email) if isinstance(email, str) and email else None,
             "authedAt": int(time.time()),
             # New auth should not imply "we already scanned everything".
             "fullScanComplete": False,
@@ -174,11 +226,21 @@ def backup(
         help="Number of concurrent worker threads for fetch+upload.",
     ),
     gzip_level: int = typer.Option(
-        6,
+        1,
         "--gzip-level",
         min=1,
         max=9,
-        help="Gzip compression level (1=fastest, 9=smallest). Lower is faster.",
+        help="Compression level (1-3 fast, 6 balanced, 9 archival). Backups are network-bound, so the fast default wins wall time.",
+    ),
+    compression: str = typer.Option(
+        "gzip",
+        "--compression",
+        help="Compression codec for message bodies: gzip (default), zstd (faster, needs 'zstandard'), or none.",
+    ),
+    fused: bool = typer.Option(
+        False,
+        "--fused",
+        help="Write one messages/<id>.tar object (body + meta) per message instead of two objects, halving PUTs.",
     ),
     auto_prefix: bool = typer.Option(
         False,
@@ -191,36 +253,45 @@ def backup(
         min=0,
         help="Print progress every N messages (0 disables).",
     ),
+    label: Optional[str] = typer.Option(
+        None,
+        "--label",
+        help="Gmail label ID (e.g. INBOX) to filter incremental history polling server-side. Full scans are unaffected.",
+    ),
 ) -> None:
+    if compression not in ("gzip", "zstd", "none"):
+        raise typer.BadParameter("Expected 'gzip', 'zstd' or 'none'", param_hint="--compression")
     _load_dotenv()
+    from .backup import BackupRunner
+    from .gmail import GmailClient
+
     cfg = load_app_config()
     r2 = R2Config.from_env_or_config(cfg)
     st = _open_state(state_dir)
     with st.run_lock():
-        st.clear_inflight_uploads()
+        state_obj = st.begin_run("upload")
         gmail = GmailClient.from_stored_token(
             token_store=st,
             scopes=[GmailClient.SCOPE_READONLY],
         )
-        r2 = _maybe_auto_prefix(r2cfg=r2, state=st, gmail=gmail, enabled=auto_prefix, explicit=_prefix_is_explicit(cfg))
-        runner = BackupRunner(gmail=gmail, r2=r2, state=st, gzip_level=gzip_level)
+        r2 = _maybe_auto_prefix(
+            r2cfg=r2,
+            state=st,
+            gmail=gmail,
+            enabled=auto_prefix,
+            explicit=_prefix_is_explicit(cfg),
+            state_obj=state_obj,
+        )
+        runner = BackupRunner(gmail=gmail, r2=r2, state=st, gzip_level=gzip_level, compression=compression, fused=fused)
         since_date = _parse_since(since)
 
-        def _progress(phase: str, n: int, stats: BackupStats, elapsed_s: float) -> None:
-            # Avoid noisy logs; just a periodic heartbeat.
-            rate = n / elapsed_s if elapsed_s > 0 else 0.0
-            print(
-                f"[{phase}] processed={n} rate={rate:.1f}/s "
-                f"uploaded={getattr(stats, 'uploaded', '?')} skipped={getattr(stats, 'skipped', '?')} errors={getattr(stats, 'errors', '?')}",
-                file=sys.stderr,
-            )
-
         stats = runner.run_backup(
             since=since_date,
             max_messages=max_messages,
             workers=workers,
             progress_every=progress_every,
-            on_progress=_progress if progress_every else None,
+            label_id=label,
+            on_progress=_emit_progress if progress_every else None,
         )
         print(
             "Backup complete:",
@@ -264,6 +335,12 @@ def restore(
         min=1,
         help="Number of concurrent worker threads for restore work.",
     ),
+    insert_batch_size: int = typer.Option(
+        10,
+        "--insert-batch-size",
+        min=1,
+        help="Group Gmail inserts into batch calls of this size (1 disables batching).",
+    ),
     auto_prefix: bool = typer.Option(
         False,
         "--auto-prefix",
@@ -277,36 +354,39 @@ def restore(
     ),
 ) -> None:
     _load_dotenv()
+    from .gmail import GmailClient
+    from .r2 import R2Client
+    from .restore import RestoreRunner
+
     cfg = load_app_config()
     r2cfg = R2Config.from_env_or_config(cfg)
     st = _open_state(state_dir)
     with st.run_lock():
-        st.clear_inflight_restores()
+        state_obj = st.begin_run("restore")
         gmail = GmailClient.from_stored_token(
             token_store=st,
             scopes=[GmailClient.SCOPE_INSERT, GmailClient.SCOPE_MODIFY],
         )
-        r2cfg = _maybe_auto_prefix(r2cfg=r2cfg, state=st, gmail=gmail, enabled=auto_prefix, explicit=_prefix_is_explicit(cfg))
+        r2cfg = _maybe_auto_prefix(
+            r2cfg=r2cfg,
+            state=st,
+            gmail=gmail,
+            enabled=auto_prefix,
+            explicit=_prefix_is_explicit(cfg),
+            state_obj=state_obj,
+        )
         r2 = R2Client(r2cfg)
-        runner = RestoreRunner(gmail=gmail, r2=r2, state=st)
+        runner = RestoreRunner(gmail=gmail, r2=r2, state=st, insert_batch_size=insert_batch_size)
 
         since_date = _parse_since(since)
 
-        def _progress(n: int, stats: RestoreStats, elapsed_s: float) -> None:
-            rate = n / elapsed_s if elapsed_s > 0 else 0.0
-            print(
-                f"[restore] considered={n} rate={rate:.1f}/s "
-                f"restored={getattr(stats, 'restored', '?')} skipped={getattr(stats, 'skipped', '?')} errors={getattr(stats, 'errors', '?')}",
-                file=sys.stderr,
-            )
-
         stats = runner.run_restore(
             apply=apply,
             since=since_date,
             max_messages=max_messages,
             workers=workers,
             progress_every=progress_every,
-            on_progress=_progress if progress_every else None,
+            on_progress=functools.partial(_emit_progress, "restore") if progress_every else None,
         )
         mode = "RESTORE" if apply else "DRY-RUN"
         print(
@@ -342,6 +422,12 @@ def rehydrate_index(
         min=0,
         help="Optional cap for testing (0 = unlimited).",
     ),
+    marker_workers: int = typer.Option(
+        32,
+        "--marker-workers",
+        min=1,
+        help="Concurrent R2 fetches for restore markers (with --restore-markers).",
+    ),
     progress_every: int = typer.Option(
         1000,
         "--progress-every",
@@ -355,6 +441,8 @@ def rehydrate_index(
     This is useful if you already have data in R2 (or moved machines) and want local counts/state to match.
     """
     _load_dotenv()
+    from .r2 import R2Client
+
     cfg = load_app_config()
     r2cfg = R2Config.from_env_or_config(cfg)
     st = _open_state(state_dir)
@@ -367,21 +455,22 @@ def rehydrate_index(
         inserted_hint = 0
         now = int(time.time())
 
+        # This loop sees every object in the bucket; one precompiled regex
+        # match extracts the message id per key (greedy group, so the longest
+        # known suffix strips first, matching the old endswith chain). Large
+        # batches amortize the per-transaction commit cost in bulk_mark_uploaded.
+        batch_size = 10_000
+        key_match = message_key_match
+
         started = time.monotonic()
         for obj in r2.iter_objects("messages/"):
             scanned += 1
             if max_messages and scanned > max_messages:
                 break
-            if not obj.key.endswith(".eml.gz"):
-                continue
-            if not obj.key.startswith("messages/"):
-                continue
-            mid = obj.key[len("messages/") : -len(".eml.gz")]
-            if not mid:
-                continue
-            uploaded_at = obj.last_modified_at or now
-            batch.append((mid, uploaded_at))
-            if len(batch) >= 2000:
+            m = key_match(obj.key)
+            if m:
+                batch.append((m.group(1), obj.last_modified_at or now))
+            if len(batch) >= batch_size:
                 st.bulk_mark_uploaded(batch)
                 inserted_hint += len(batch)
                 batch.clear()
@@ -389,7 +478,11 @@ def rehydrate_index(
             if progress_every and (scanned % int(progress_every) == 0):
                 elapsed = time.monotonic() - started
                 rate = scanned / elapsed if elapsed > 0 else 0.0
-                print(f"[rehydrate] scanned={scanned} rate={rate:.1f}/s local_uploaded={st.uploaded_count()}", file=sys.stderr)
+                # Running estimate (duplicates collapse on insert); the exact
+                # count is printed once at the end rather than re-scanning the
+                # table on every progress tick.
+                local_uploaded = before + inserted_hint + len(batch)
+                sys.stderr.write(f"[rehydrate] scanned={scanned} rate={rate:.1f}/s local_uploaded~={local_uploaded}\n")
 
         if batch:
             st.bulk_mark_uploaded(batch)
@@ -401,26 +494,60 @@ def rehydrate_index(
         if restore_markers:
             before_r = st.restored_count()
             scanned_r = 0
-            for obj in r2.iter_objects("state/restore/"):
-                scanned_r += 1
-                if not obj.key.endswith(".json"):
-                    continue
-                marker = r2.get_json_or_none(obj.key)
-                if not isinstance(marker, dict):
-                    continue
-                source_id = marker.get("sourceId")
-                if not isinstance(source_id, str) or not source_id:
-                    continue
-                st.mark_restored(
-                    source_message_id=source_id,
-                    restored_message_id=marker.get("restoredId") if isinstance(marker.get("restoredId"), str) else None,
-                    message_id_header=marker.get("messageIdHeader")
-                    if isinstance(marker.get("messageIdHeader"), str)
-                    else None,
-                    raw_sha256=marker.get("rawSha256") if isinstance(marker.get("rawSha256"), str) else None,
-                )
-                if progress_every and (scanned_r % int(progress_every) == 0):
-                    print(f"[rehydrate] scanned_restore_markers={scanned_r} restored_rows={st.restored_count()}", file=sys.stderr)
+
+            def _marker_keys() -> Iterator[str]:
+                for obj in r2.iter_objects("state/restore/"):
+                    if obj.key.endswith(".json"):
+                        yield obj.key
+
+            # Markers are tiny JSON objects, so the loop is round-trip-bound;
+            # fetch them concurrently and keep the sqlite writes on this thread,
+            # batched so each flush is one transaction instead of a commit per row.
+            restored_batch: list[tuple[str, str | None, str | None, str | None]] = []
+            marked_r = 0
+
+            def apply_markers(done: set[Future[Any]]) -> None:
+                nonlocal scanned_r, marked_r
+                for f in done:
+                    marker = f.result()
+                    scanned_r += 1
+                    if not isinstance(marker, dict):
+                        continue
+                    source_id = marker.get("sourceId")
+                    if not isinstance(source_id, str) or not source_id:
+                        continue
+                    restored_batch.append(
+                        (
+                            source_id,
+                            marker.get("restoredId") if isinstance(marker.get("restoredId"), str) else None,
+                            marker.get("messageIdHeader") if isinstance(marker.get("messageIdHeader"), str) else None,
+                            marker.get("rawSha256") if isinstance(marker.get("rawSha256"), str) else None,
+                        )
+                    )
+                    marked_r += 1
+                    if len(restored_batch) >= 2000:
+                        st.bulk_mark_restored(restored_batch)
+                        restored_batch.clear()
+                    if progress_every and (scanned_r % int(progress_every) == 0):
+                        sys.stderr.write(f"[rehydrate] scanned_restore_markers={scanned_r} restored_rows~={before_r + marked_r}\n")
+
+            with ThreadPoolExecutor(max_workers=int(marker_workers), thread_name_prefix="marker") as ex:
+                # Bound in-flight fetches: Executor.map would exhaust the key
+                # listing up front and queue a future per marker, so large
+                # buckets get the same pending/FIRST_COMPLETED window the
+                # backup loop uses instead.
+                pending: set[Future[Any]] = set()
+                max_pending = max(int(marker_workers) * 2, 2)
+                for key in _marker_keys():
+                    pending.add(ex.submit(r2.get_json_or_none, key))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        apply_markers(done)
+                if pending:
+                    done, _ = wait(pending)
+                    apply_markers(done)
+            if restored_batch:
+                st.bulk_mark_restored(restored_batch)
             after_r = st.restored_count()
             print(f"Rehydrated restore index: restored_rows {before_r} -> {after_r} (delta={after_r - before_r})")
 
@@ -437,27 +564,55 @@ def daemon(
     max_messages: int = typer.Option(0, "--max-messages", min=0),
     workers: int = typer.Option(4, "--workers", min=1),
     auto_prefix: bool = typer.Option(False, "--auto-prefix"),
+    label: Optional[str] = typer.Option(
+        None,
+        "--label",
+        help="Gmail label ID (e.g. INBOX) to filter incremental history polling server-side.",
+    ),
 ) -> None:
-    while True:
-        try:
-            backup(
-                state_dir=state_dir,
-                since=since,
-                max_messages=max_messages,
-                workers=workers,
-                auto_prefix=auto_prefix,
-            )
-        except typer.Exit as e:
-            # backup() uses Exit(code=2) to signal "completed with errors".
-            if getattr(e, "exit_code", 0) not in (0, None):
-                print("Backup run exited non-zero:", e.exit_code, file=sys.stderr)
-            else:
-                raise
-        except KeyboardInterrupt:
-            raise typer.Exit(code=130)
-        except Exception as e:
-            print("Backup run crashed:", repr(e), file=sys.stderr)
-        time.sleep(int(every))
+    # Set up config, token, clients, and runner once; each tick only does the
+    # incremental work. Re-entering the backup command per tick would redo
+    # dotenv/config parsing, token refresh checks, and client construction
+    # (plus a sqlite lock cycle) every 30 seconds.
+    _load_dotenv()
+    from .backup import BackupRunner
+    from .gmail import GmailClient
+
+    cfg = load_app_config()
+    r2cfg = R2Config.from_env_or_config(cfg)
+    st = _open_state(state_dir)
+    since_date = _parse_since(since)
+    with st.run_lock():
+        gmail = GmailClient.from_stored_token(
+            token_store=st,
+            scopes=[GmailClient.SCOPE_READONLY],
+        )
+        r2cfg = _maybe_auto_prefix(
+            r2cfg=r2cfg, state=st, gmail=gmail, enabled=auto_prefix, explicit=_prefix_is_explicit(cfg)
+        )
+        runner = BackupRunner(gmail=gmail, r2=r2cfg, state=st)
+        while True:
+            try:
+                st.clear_inflight_uploads()
+                stats = runner.run_backup(
+                    since=since_date,
+                    max_messages=max_messages,
+                    workers=workers,
+                    label_id=label,
+                )
+                print(
+                    "Backup tick complete:",
+                    f"uploaded={stats.uploaded}",
+                    f"skipped={stats.skipped}",
+                    f"errors={stats.errors}",
+                )
+                if stats.errors:
+                    print("Backup run completed with errors:", stats.errors, file=sys.stderr)
+            except KeyboardInterrupt:
+                raise typer.Exit(code=130)
+            except Exception as e:
+                print("Backup run crashed:", repr(e), file=sys.stderr)
+            time.sleep(int(every))
 
 
 def main(argv: Optional[list[str]] = None) -> None:
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import json
 import os
 from typing import Optional
@@ -31,15 +32,31 @@ class AppConfig(BaseModel):
     r2: Optional[R2FileConfig] = None
 
 
+_app_config_cache: tuple[str, int, AppConfig] | None = None
+
+
 def load_app_config() -> AppConfig:
+    # Cached on (path, mtime): repeat calls in one process (notably daemon
+    # ticks) skip the re-read and Pydantic re-validation, while an edited
+    # config.json is still picked up.
+    global _app_config_cache
     path = _config_path()
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = -1
+    cached = _app_config_cache
+    if cached is not None and cached[0] == path and cached[1] == mtime_ns:
+        return cached[2]
     try:
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
     except FileNotFoundError:
         data = {}
     # Validate but be permissive: unknown keys are ignored.
-    return AppConfig.model_validate(data)
+    cfg = AppConfig.model_validate(data)
+    _app_config_cache = (path, mtime_ns, cfg)
+    return cfg
 
 
 class _R2Env(BaseSettings):
@@ -53,6 +70,19 @@ class _R2Env(BaseSettings):
     region: Optional[str] = Field(default=None, validation_alias="R2_REGION")
 
 
+@functools.lru_cache(maxsize=1)
+def _r2_env() -> _R2Env:
+    # BaseSettings walks os.environ and re-validates on every construction;
+    # one snapshot per process is enough (the environment doesn't change
+    # under a running CLI).
+    return _R2Env()
+
+
+def reset_env_cache() -> None:
+    """Forget the cached environment snapshot (tests mutate os.environ)."""
+    _r2_env.cache_clear()
+
+
 class R2Config(BaseModel):
     model_config = ConfigDict(frozen=True)
 
@@ -63,7 +93,7 @@ class R2Config(BaseModel):
 
     @staticmethod
     def from_env_or_config(cfg: AppConfig) -> "R2Config":
-        env = _R2Env()
+        env = _r2_env()
         file_r2 = cfg.r2 or R2FileConfig()
 
         endpoint_url = env.endpoint_url or file_r2.endpoint_url
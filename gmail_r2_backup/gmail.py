@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import base64
+import io
 import json
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from typing import Any, Iterable, Optional, cast
 
 from google.auth.transport.requests import Request
@@ -11,9 +15,13 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 
 from .state import StateStore
 
+# Statuses worth retrying; a frozenset keeps the per-error check a hash probe.
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
 
 class GmailClient:
     SCOPE_READONLY = "https://www.googleapis.com/auth/gmail.readonly"
@@ -22,7 +30,10 @@ class GmailClient:
 
     def __init__(self, creds: Credentials):
         self._creds = creds
-        self._svc = build("gmail", "v1", credentials=creds, cache_discovery=False)
+        # static_discovery pins the bundled discovery document so client
+        # construction never fetches (or re-parses a cached copy of) the
+        # ~100 KB discovery JSON over the network — this runs per worker clone.
+        self._svc = build("gmail", "v1", credentials=creds, cache_discovery=False, static_discovery=True)
 
     def clone(self) -> "GmailClient":
         """
@@ -61,7 +72,7 @@ class GmailClient:
     @classmethod
     def _should_retry(cls, err: HttpError) -> bool:
         status = getattr(getattr(err, "resp", None), "status", None)
-        if status in (429, 500, 502, 503, 504):
+        if status in _RETRY_STATUSES:
             return True
         if status == 403:
             reason = cls._error_reason(err)
@@ -69,19 +80,52 @@ class GmailClient:
                 return True
         return False
 
+    @classmethod
+    def is_rate_limit_error(cls, err: Exception) -> bool:
+        """True for responses that mean "back off": 429 or a rate-limit 403."""
+        if not isinstance(err, HttpError):
+            return False
+        status = getattr(getattr(err, "resp", None), "status", None)
+        if status == 429:
+            return True
+        return status == 403 and cls._error_reason(err) in ("rateLimitExceeded", "userRateLimitExceeded")
+
+    # Backoff ceiling; also bounds how long a server-sent Retry-After is honored.
+    RETRY_CAP_S = 60.0
+
+    @classmethod
+    def _retry_after_seconds(cls, err: HttpError) -> float | None:
+        # httplib2 responses are dict-like with lower-cased header names.
+        resp = getattr(err, "resp", None)
+        value = resp.get("retry-after") if resp is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
     @classmethod
     def _execute_with_retries(cls, req: Any, *, max_attempts: int = 8) -> Any:
-        delay_s = 1.0
+        execute = req.execute  # bound once; this wrapper runs on every API call
         for attempt in range(1, max_attempts + 1):
             try:
-                return req.execute()
+                return execute()
             except HttpError as e:
                 if attempt >= max_attempts or not cls._should_retry(e):
                     raise
-                # Exponential backoff with jitter, capped.
-                sleep_s = delay_s * (0.5 + random.random())
-                time.sleep(min(sleep_s, 60.0))
-                delay_s = min(delay_s * 2.0, 60.0)
+                # The server knows its own window best; otherwise full jitter
+                # (uniform over [0, capped exponential]) scatters retries from
+                # concurrent workers better than jittering around the midpoint.
+                sleep_s = cls._retry_after_seconds(e)
+                if sleep_s is None:
+                    sleep_s = random.random() * min(cls.RETRY_CAP_S, 2.0 ** (attempt - 1))
+                time.sleep(min(sleep_s, cls.RETRY_CAP_S))
 
     @staticmethod
     def _normalize_scopes(v: Any) -> list[str] | None:
@@ -144,7 +188,7 @@ class GmailClient:
         creds = Credentials.from_authorized_user_info(token_json, scopes=effective_scopes)
         if creds.expired and creds.refresh_token:
             creds.refresh(Request())
-            token_store.write_token_json(json.loads(creds.to_json()))
+            token_store.write_token_text(creds.to_json())
         return GmailClient(creds)
 
     @staticmethod
@@ -155,7 +199,7 @@ class GmailClient:
     ) -> "GmailClient":
         flow = InstalledAppFlow.from_client_secrets_file(credentials_path, scopes=scopes)
         creds = flow.run_local_server(port=0)
-        token_store.write_token_json(json.loads(creds.to_json()))
+        token_store.write_token_text(creds.to_json())
         return GmailClient(creds)
 
     @staticmethod
@@ -179,18 +223,21 @@ class GmailClient:
         }
         flow = InstalledAppFlow.from_client_config(cfg, scopes=scopes)
         creds = flow.run_local_server(port=0)
-        token_store.write_token_json(json.loads(creds.to_json()))
+        token_store.write_token_text(creds.to_json())
         return GmailClient(creds)
 
     def get_profile(self) -> dict[str, Any]:
         req = self._svc.users().getProfile(userId="me")
         return cast(dict[str, Any], self._execute_with_retries(req))
 
-    def list_messages(self, q: str | None = None, max_results: int = 0) -> Iterable[str]:
-        # Yields message IDs
-        page_token = None
+    def list_message_id_pages(self, q: str | None = None, max_results: int = 0) -> Iterable[list[str]]:
+        # Yields one list of message ids per API page (up to 500). Page K+1 is
+        # requested in the background while page K is consumed, hiding one
+        # list RTT per page instead of serializing the whole page walk ahead
+        # of the fetch workers.
         yielded = 0
-        while True:
+
+        def _fetch(page_token: str | None) -> dict[str, Any]:
             req = self._svc.users().messages().list(
                 userId="me",
                 q=q,
@@ -198,27 +245,45 @@ class GmailClient:
                 maxResults=500,
                 includeSpamTrash=True,
             )
-            resp = self._execute_with_retries(req)
-            for m in resp.get("messages", []) or []:
-                mid = m.get("id")
-                if not mid:
-                    continue
-                yield mid
-                yielded += 1
-                if max_results and yielded >= max_results:
+            return cast(dict[str, Any], self._execute_with_retries(req))
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="gmail-page") as ex:
+            resp = _fetch(None)
+            while True:
+                token = resp.get("nextPageToken")
+                # At most one page in flight; an early exit waits out a single
+                # request on executor shutdown.
+                nxt = ex.submit(_fetch, token) if token else None
+                ids = [m["id"] for m in resp.get("messages", []) or [] if m.get("id")]
+                if max_results and yielded + len(ids) > max_results:
+                    ids = ids[: max_results - yielded]
+                yielded += len(ids)
+                if ids:
+                    yield ids
+                if nxt is None or (max_results and yielded >= max_results):
                     return
-            page_token = resp.get("nextPageToken")
-            if not page_token:
-                return
+                resp = nxt.result()
 
-    def history_message_added(self, start_history_id: str, max_results: int = 0) -> tuple[list[str], str | None, str | None]:
-        # Returns (message_ids, latest_history_id, next_page_token)
-        req = self._svc.users().history().list(
-            userId="me",
-            startHistoryId=start_history_id,
-            historyTypes=["messageAdded"],
-            maxResults=500,
-        )
+    def list_messages(self, q: str | None = None, max_results: int = 0) -> Iterable[str]:
+        # Yields message IDs; see list_message_id_pages for the paging details.
+        for page in self.list_message_id_pages(q=q, max_results=max_results):
+            yield from page
+
+    def history_message_added(
+        self, start_history_id: str, max_results: int = 0, label_id: str | None = None
+    ) -> tuple[list[str], str | None, str | None]:
+        # Returns (message_ids, latest_history_id, next_page_token).
+        # label_id is a server-side filter: Gmail counts history records
+        # pre-filter towards the page size, so narrowing cuts page count.
+        kwargs: dict[str, Any] = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded"],
+            "maxResults": 500,
+        }
+        if label_id:
+            kwargs["labelId"] = label_id
+        req = self._svc.users().history().list(**kwargs)
         resp = self._execute_with_retries(req)
         ids: list[str] = []
         for h in resp.get("history", []) or []:
@@ -233,18 +298,23 @@ class GmailClient:
                 break
         return ids, resp.get("historyId"), resp.get("nextPageToken")
 
-    def history_message_added_paged(self, start_history_id: str, max_results: int = 0) -> Iterable[tuple[list[str], str | None]]:
-        # Yields (message_ids, latest_history_id) per page
+    def history_message_added_paged(
+        self, start_history_id: str, max_results: int = 0, label_id: str | None = None
+    ) -> Iterable[tuple[list[str], str | None]]:
+        # Yields (message_ids, latest_history_id) per page.
         page_token = None
         yielded = 0
         while True:
-            req = self._svc.users().history().list(
-                userId="me",
-                startHistoryId=start_history_id,
-                historyTypes=["messageAdded"],
-                maxResults=500,
-                pageToken=page_token,
-            )
+            kwargs: dict[str, Any] = {
+                "userId": "me",
+                "startHistoryId": start_history_id,
+                "historyTypes": ["messageAdded"],
+                "maxResults": 500,
+                "pageToken": page_token,
+            }
+            if label_id:
+                kwargs["labelId"] = label_id
+            req = self._svc.users().history().list(**kwargs)
             resp = self._execute_with_retries(req)
             ids: list[str] = []
             for h in resp.get("history", []) or []:
@@ -263,18 +333,14 @@ class GmailClient:
             if not page_token or (max_results and yielded >= max_results):
                 return
 
-    def get_message_raw(self, message_id: str) -> tuple[bytes, dict[str, Any]]:
-        msg = (
-            self._svc.users()
-            .messages()
-            .get(userId="me", id=message_id, format="raw")
-        )
-        msg = self._execute_with_retries(msg)
-        msg = cast(dict[str, Any], msg)
+    @staticmethod
+    def _raw_from_message(msg: dict[str, Any]) -> tuple[bytes, dict[str, Any]]:
         raw_b64 = msg.get("raw")
         if not raw_b64:
             raise ValueError("No raw content for message")
-        raw_bytes = base64.urlsafe_b64decode(raw_b64.encode("ascii"))
+        # b64decode takes str directly; encoding first would duplicate the
+        # whole payload (raws can be tens of MB) just to throw the copy away.
+        raw_bytes = base64.urlsafe_b64decode(raw_b64)
         meta = {
             "id": msg.get("id"),
             "threadId": msg.get("threadId"),
@@ -285,10 +351,176 @@ class GmailClient:
         }
         return raw_bytes, meta
 
+    def get_message_raw(self, message_id: str) -> tuple[bytes, dict[str, Any]]:
+        req = (
+            self._svc.users()
+            .messages()
+            .get(userId="me", id=message_id, format="raw")
+        )
+        msg = cast(dict[str, Any], self._execute_with_retries(req))
+        return self._raw_from_message(msg)
+
+    # Gmail's JSON batch endpoint accepts up to 100 sub-requests; stay below to
+    # keep response bodies and per-batch rate-limit exposure reasonable.
+    BATCH_GET_SIZE = 50
+
+    def get_messages_raw_batch(
+        self, message_ids: list[str]
+    ) -> tuple[dict[str, tuple[bytes, dict[str, Any]]], dict[str, Exception]]:
+        """
+        Fetch raw messages via the Gmail batch endpoint (one HTTP round-trip per
+        ~BATCH_GET_SIZE ids instead of one per message).
+
+        Returns (results, errors) keyed by message id. Retryable per-id failures
+        are re-fetched individually (with backoff) before being reported.
+        """
+        results: dict[str, tuple[bytes, dict[str, Any]]] = {}
+        errors: dict[str, Exception] = {}
+        failed: dict[str, HttpError] = {}
+
+        def _cb(request_id: str, response: Any, exception: Exception | None) -> None:
+            if exception is not None:
+                if isinstance(exception, HttpError):
+                    failed[request_id] = exception
+                else:
+                    errors[request_id] = exception
+                return
+            try:
+                results[request_id] = self._raw_from_message(cast(dict[str, Any], response))
+            except ValueError as e:
+                errors[request_id] = e
+
+        for start in range(0, len(message_ids), self.BATCH_GET_SIZE):
+            chunk = message_ids[start : start + self.BATCH_GET_SIZE]
+            batch = self._svc.new_batch_http_request(callback=_cb)
+            for mid in chunk:
+                batch.add(
+                    self._svc.users().messages().get(userId="me", id=mid, format="raw"),
+                    request_id=mid,
+                )
+            self._execute_with_retries(batch)
+
+        # Per-id failures inside an otherwise-successful batch: retry the
+        # retryable ones individually so one throttled id doesn't sink the page.
+        for mid, err in failed.items():
+            if not self._should_retry(err):
+                errors[mid] = err
+                continue
+            try:
+                results[mid] = self.get_message_raw(mid)
+            except Exception as e:
+                errors[mid] = e
+        return results, errors
+
+    # Insert bodies carry the whole base64 message, so batches stay small:
+    # most of the win is saved request/response framing, not payload sharing.
+    BATCH_INSERT_SIZE = 10
+
+    def insert_messages_raw_batch(
+        self,
+        items: list[tuple[str, bytes, list[str] | None]],
+        *,
+        internal_date_source: str = "dateHeader",
+    ) -> tuple[dict[str, dict[str, Any]], dict[str, Exception]]:
+        """
+        Insert several raw messages via the Gmail batch endpoint.
+
+        items is a list of (request_id, raw_bytes, label_ids); returns
+        (results, errors) keyed by request_id. Retryable per-id failures are
+        re-inserted individually (with backoff) before being reported.
+        """
+        results: dict[str, dict[str, Any]] = {}
+        errors: dict[str, Exception] = {}
+        failed: dict[str, HttpError] = {}
+        by_id = {rid: (raw, labels) for rid, raw, labels in items}
+
+        def _cb(request_id: str, response: Any, exception: Exception | None) -> None:
+            if exception is not None:
+                if isinstance(exception, HttpError):
+                    failed[request_id] = exception
+                else:
+                    errors[request_id] = exception
+                return
+            results[request_id] = cast(dict[str, Any], response)
+
+        for start in range(0, len(items), self.BATCH_INSERT_SIZE):
+            chunk = items[start : start + self.BATCH_INSERT_SIZE]
+            batch = self._svc.new_batch_http_request(callback=_cb)
+            for rid, raw_bytes, label_ids in chunk:
+                body: dict[str, Any] = {"raw": base64.urlsafe_b64encode(raw_bytes).decode("ascii")}
+                if label_ids:
+                    body["labelIds"] = label_ids
+                batch.add(
+                    self._svc.users()
+                    .messages()
+                    .insert(userId="me", internalDateSource=internal_date_source, body=body),
+                    request_id=rid,
+                )
+            self._execute_with_retries(batch)
+
+        # Throttled sub-requests are retried one by one so a single 429 doesn't
+        # fail every message that happened to share its batch.
+        for rid, err in failed.items():
+            if not self._should_retry(err):
+                errors[rid] = err
+                continue
+            raw_bytes, label_ids = by_id[rid]
+            try:
+                results[rid] = self.insert_message_raw(
+                    raw_bytes, label_ids=label_ids, internal_date_source=internal_date_source
+                )
+            except Exception as e:
+                errors[rid] = e
+        return results, errors
+
     def search_message_ids(self, q: str, max_results: int = 0) -> Iterable[str]:
         # Convenience wrapper for dedupe queries during restore.
         return self.list_messages(q=q, max_results=max_results)
 
+    def search_message_ids_batch(
+        self, queries: list[tuple[str, str]]
+    ) -> tuple[dict[str, bool], dict[str, Exception]]:
+        """
+        Run several messages.list searches via the Gmail batch endpoint.
+
+        queries is a list of (request_id, q); returns (results, errors) keyed
+        by request_id, where a result is whether the query matched anything.
+        Retryable per-id failures are re-run individually before being reported.
+        """
+        results: dict[str, bool] = {}
+        errors: dict[str, Exception] = {}
+        failed: dict[str, HttpError] = {}
+        by_id = dict(queries)
+
+        def _cb(request_id: str, response: Any, exception: Exception | None) -> None:
+            if exception is not None:
+                if isinstance(exception, HttpError):
+                    failed[request_id] = exception
+                else:
+                    errors[request_id] = exception
+                return
+            results[request_id] = bool((response or {}).get("messages"))
+
+        for start in range(0, len(queries), self.BATCH_GET_SIZE):
+            chunk = queries[start : start + self.BATCH_GET_SIZE]
+            batch = self._svc.new_batch_http_request(callback=_cb)
+            for rid, q in chunk:
+                batch.add(
+                    self._svc.users().messages().list(userId="me", q=q, maxResults=1),
+                    request_id=rid,
+                )
+            self._execute_with_retries(batch)
+
+        for rid, err in failed.items():
+            if not self._should_retry(err):
+                errors[rid] = err
+                continue
+            try:
+                results[rid] = any(True for _ in self.search_message_ids(q=by_id[rid], max_results=1))
+            except Exception as e:
+                errors[rid] = e
+        return results, errors
+
     def insert_message_raw(
         self,
         raw_bytes: bytes,
@@ -297,10 +529,14 @@ class GmailClient:
         internal_date_source: str = "dateHeader",
     ) -> dict[str, Any]:
         # See: users.messages.insert
-        raw_b64 = base64.urlsafe_b64encode(raw_bytes).decode("ascii")
-        body: dict[str, Any] = {"raw": raw_b64}
+        # Media upload ships the bytes as message/rfc822 directly, skipping the
+        # base64 expansion (+33% on the wire plus two full-size allocations)
+        # the JSON "raw" body needs. The batch endpoint can't carry media, so
+        # batched inserts keep the base64 form (see insert_messages_raw_batch).
+        body: dict[str, Any] = {}
         if label_ids:
             body["labelIds"] = label_ids
+        media = MediaIoBaseUpload(io.BytesIO(raw_bytes), mimetype="message/rfc822", resumable=False)
         req = (
             self._svc.users()
             .messages()
@@ -308,6 +544,7 @@ class GmailClient:
                 userId="me",
                 internalDateSource=internal_date_source,
                 body=body,
+                media_body=media,
             )
         )
         return cast(dict[str, Any], self._execute_with_retries(req))
@@ -325,9 +562,75 @@ class GmailClient:
         req = self._svc.users().messages().trash(userId="me", id=message_id)
         return cast(dict[str, Any], self._execute_with_retries(req))
 
+    def modify_and_trash(self, message_id: str, *, add: list[str] | None, trash: bool) -> None:
+        """
+        Post-insert fixup in one HTTP round trip: when both a label modify and
+        a trash are needed they ride the batch endpoint together.
+        """
+        reqs: list[Any] = []
+        if add:
+            reqs.append(self._svc.users().messages().modify(userId="me", id=message_id, body={"addLabelIds": add}))
+        if trash:
+            reqs.append(self._svc.users().messages().trash(userId="me", id=message_id))
+        if not reqs:
+            return
+        if len(reqs) == 1:
+            self._execute_with_retries(reqs[0])
+            return
+        batch = self._svc.new_batch_http_request()
+        for req in reqs:
+            batch.add(req)
+        self._execute_with_retries(batch)
+
     @staticmethod
     def is_history_too_old(err: Exception) -> bool:
         if not isinstance(err, HttpError):
             return False
         # Gmail returns 404 for invalid/too-old startHistoryId.
         return err.resp is not None and getattr(err.resp, "status", None) == 404
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency gate for Gmail calls that adapts to per-user rate limits.
+
+    Gmail caps concurrent requests per user; blindly fanning out --workers
+    requests can trigger 429 storms where retries amplify the load. Permits
+    halve on a throttled response (down to 1) and creep back up after a run
+    of successes.
+    """
+
+    RAMP_SUCCESSES = 256
+
+    def __init__(self, max_permits: int):
+        self._max = max(1, int(max_permits))
+        self._permits = self._max
+        self._active = 0
+        self._successes = 0
+        self._cv = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cv:
+            while self._active >= self._permits:
+                self._cv.wait()
+            self._active += 1
+
+    def release(self, *, throttled: bool = False) -> None:
+        with self._cv:
+            self._active -= 1
+            if throttled:
+                self._permits = max(1, self._permits // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.RAMP_SUCCESSES and self._permits < self._max:
+                    self._permits += 1
+                    self._successes = 0
+            self._cv.notify_all()
+
+    def __enter__(self) -> "AdaptiveLimiter":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.release(throttled=isinstance(exc, Exception) and GmailClient.is_rate_limit_error(exc))
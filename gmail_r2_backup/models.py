@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any, Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 
 
 class MessageMeta(BaseModel):
@@ -20,6 +20,11 @@ class MessageMeta(BaseModel):
         return list(self.labelIds or [])
 
 
+# Built once at import: parse_message_meta runs per restore candidate and a
+# hoisted adapter skips the per-call schema lookup model_validate does.
+_META_ADAPTER: TypeAdapter[MessageMeta] = TypeAdapter(MessageMeta)
+
+
 def parse_message_meta(obj: Any) -> MessageMeta:
-    return MessageMeta.model_validate(obj)
+    return _META_ADAPTER.validate_python(obj)
 
@@ -21,3 +21,9 @@ def r2_prefix_from_email(email_address: str) -> str:
         s = "gmail"
     return f"gmail-backup/{s}"
 
+
+# Message-object keys as written by the backup path (messages/<id> plus one of
+# the known body suffixes); group 1 is the message id. Shared by every code
+# path that maps R2 keys back to message ids.
+message_key_match = re.compile(r"messages/(.+)\.(?:eml\.gz|eml\.zst|tar|eml)$").match
+
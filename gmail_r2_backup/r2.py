@@ -1,7 +1,11 @@
 from __future__ import annotations
 
 import datetime as dt
+import io
 import json
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, cast, Iterator
 
@@ -25,19 +29,137 @@ class ListedObject:
     last_modified_at: int | None  # epoch seconds (UTC) when available
 
 
+class StreamingUpload:
+    """
+    File-like writer that spills to a multipart upload in part-size pieces.
+
+    Peak memory stays O(part size) no matter how large the object gets. Small
+    payloads that never reach one part are written with a single PUT on close.
+    Use as a context manager: an exception aborts the multipart upload.
+    """
+
+    def __init__(self, client: "R2Client", key: str, content_type: str | None):
+        self._client = client
+        self._key = key
+        self._content_type = content_type
+        self._buf = bytearray()
+        self._upload_id: str | None = None
+        self._parts: list[dict[str, Any]] = []
+        self._part_no = 1
+        self.closed = False
+
+    def __enter__(self) -> "StreamingUpload":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self, b: bytes) -> int:
+        self._buf += b
+        while len(self._buf) >= R2Client.MULTIPART_PART_SIZE:
+            self._flush_part()
+        return len(b)
+
+    def _flush_part(self) -> None:
+        s3 = self._client._s3
+        bucket = self._client._cfg.bucket
+        if self._upload_id is None:
+            extra: dict[str, Any] = {}
+            if self._content_type:
+                extra["ContentType"] = self._content_type
+            mp = s3.create_multipart_upload(Bucket=bucket, Key=self._key, **extra)
+            self._upload_id = mp["UploadId"]
+        body = bytes(self._buf[: R2Client.MULTIPART_PART_SIZE])
+        del self._buf[: R2Client.MULTIPART_PART_SIZE]
+        resp = s3.upload_part(
+            Bucket=bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=self._part_no,
+            Body=body,
+        )
+        self._parts.append({"PartNumber": self._part_no, "ETag": resp["ETag"]})
+        self._part_no += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        s3 = self._client._s3
+        bucket = self._client._cfg.bucket
+        if self._upload_id is None:
+            extra: dict[str, Any] = {}
+            if self._content_type:
+                extra["ContentType"] = self._content_type
+            s3.put_object(Bucket=bucket, Key=self._key, Body=bytes(self._buf), **extra)
+            return
+        if self._buf:
+            self._flush_part_final()
+        s3.complete_multipart_upload(
+            Bucket=bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def _flush_part_final(self) -> None:
+        s3 = self._client._s3
+        resp = s3.upload_part(
+            Bucket=self._client._cfg.bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=self._part_no,
+            Body=bytes(self._buf),
+        )
+        self._buf.clear()
+        self._parts.append({"PartNumber": self._part_no, "ETag": resp["ETag"]})
+        self._part_no += 1
+
+    def abort(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._upload_id is None:
+            return
+        try:
+            self._client._s3.abort_multipart_upload(
+                Bucket=self._client._cfg.bucket, Key=self._key, UploadId=self._upload_id
+            )
+        except ClientError:
+            pass
+
+
 class R2Client:
-    def __init__(self, cfg: R2Config):
+    def __init__(self, cfg: R2Config, *, max_pool_connections: int = 32):
         # R2 is S3-compatible; boto3 uses AWS_* env vars for credentials.
+        # Pool is sized above botocore's default of 10 so concurrent PUTs from
+        # one client don't queue behind each other; keepalive reuses TLS
+        # connections across the many small per-message requests.
         self._cfg = cfg
         self._s3 = boto3.client(
             "s3",
             region_name=cfg.region,
             endpoint_url=cfg.endpoint_url,
             config=BotoConfig(
-                retries={"max_attempts": 10, "mode": "standard"},
+                retries={"max_attempts": 10, "mode": "adaptive"},
                 s3={"addressing_style": "path"},
+                max_pool_connections=max_pool_connections,
+                tcp_keepalive=True,
             ),
         )
+        # Hoisted out of the per-object loop in list_keys/iter_objects.
+        self._strip_prefix = (cfg.prefix.rstrip("/") + "/") if cfg.prefix else ""
+
+    def prewarm(self) -> None:
+        """Open the HTTPS connection (DNS + TLS handshake) ahead of concurrent use."""
+        try:
+            self._s3.head_bucket(Bucket=self._cfg.bucket)
+        except ClientError:
+            # Permission problems will surface with context on the first real call.
+            pass
 
     def _key(self, key: str) -> str:
         key = key.lstrip("/")
@@ -45,21 +167,94 @@ class R2Client:
             return key
         return f"{self._cfg.prefix}/{key}"
 
+    # Single PUT streams top out well below link speed for large objects;
+    # above this threshold a multipart upload with parallel parts wins.
+    MULTIPART_THRESHOLD = 16 * 1024 * 1024
+    MULTIPART_PART_SIZE = 16 * 1024 * 1024
+    MULTIPART_WORKERS = 4
+
     def put_bytes(self, key: str, data: bytes, content_type: str | None = None) -> PutResult:
+        if len(data) > self.MULTIPART_THRESHOLD:
+            return self._put_bytes_multipart(key, data, content_type)
         extra: dict[str, Any] = {}
         if content_type:
             extra["ContentType"] = content_type
         resp = self._s3.put_object(Bucket=self._cfg.bucket, Key=self._key(key), Body=data, **extra)
         return PutResult(etag=resp.get("ETag"))
 
+    def _put_bytes_multipart(self, key: str, data: bytes, content_type: str | None = None) -> PutResult:
+        full_key = self._key(key)
+        extra: dict[str, Any] = {}
+        if content_type:
+            extra["ContentType"] = content_type
+        mp = self._s3.create_multipart_upload(Bucket=self._cfg.bucket, Key=full_key, **extra)
+        upload_id = mp["UploadId"]
+        view = memoryview(data)
+
+        def _upload_part(part_number: int, start: int) -> dict[str, Any]:
+            resp = self._s3.upload_part(
+                Bucket=self._cfg.bucket,
+                Key=full_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=view[start : start + self.MULTIPART_PART_SIZE].tobytes(),
+            )
+            return {"PartNumber": part_number, "ETag": resp["ETag"]}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.MULTIPART_WORKERS) as ex:
+                futs = [
+                    ex.submit(_upload_part, i + 1, start)
+                    for i, start in enumerate(range(0, len(data), self.MULTIPART_PART_SIZE))
+                ]
+                parts = [f.result() for f in futs]
+            resp = self._s3.complete_multipart_upload(
+                Bucket=self._cfg.bucket,
+                Key=full_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": sorted(parts, key=lambda p: int(p["PartNumber"]))},
+            )
+        except Exception:
+            # Don't leave orphaned parts accruing storage; abort is best-effort.
+            try:
+                self._s3.abort_multipart_upload(Bucket=self._cfg.bucket, Key=full_key, UploadId=upload_id)
+            except ClientError:
+                pass
+            raise
+        return PutResult(etag=resp.get("ETag"))
+
     def put_json(self, key: str, obj: Any) -> PutResult:
         data = json.dumps(obj, indent=2, sort_keys=True).encode("utf-8")
         return self.put_bytes(key, data, content_type="application/json")
 
+    def open_streaming_writer(self, key: str, content_type: str | None = None) -> StreamingUpload:
+        return StreamingUpload(self, self._key(key), content_type)
+
+    def put_tar(self, key: str, members: list[tuple[str, bytes]]) -> PutResult:
+        # Pack several small payloads into one object so they cost one PUT.
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tf:
+            for name, data in members:
+                info = tarfile.TarInfo(name=name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tf.addfile(info, io.BytesIO(data))
+        return self.put_bytes(key, buf.getvalue(), content_type="application/x-tar")
+
     def get_bytes(self, key: str) -> bytes:
         resp = self._s3.get_object(Bucket=self._cfg.bucket, Key=self._key(key))
         return cast(bytes, resp["Body"].read())
 
+    def get_streaming_body(self, key: str) -> Any:
+        """
+        The unread response body (a file-like botocore StreamingBody).
+
+        Lets callers decompress or hash while bytes arrive instead of
+        buffering the whole object first.
+        """
+        resp = self._s3.get_object(Bucket=self._cfg.bucket, Key=self._key(key))
+        return resp["Body"]
+
     def get_json_or_none(self, key: str) -> Any | None:
         try:
             resp = self._s3.get_object(Bucket=self._cfg.bucket, Key=self._key(key))
@@ -87,9 +282,7 @@ class R2Client:
                 if not k:
                     continue
                 # Strip configured prefix to return relative keys.
-                if self._cfg.prefix and k.startswith(self._cfg.prefix.rstrip("/") + "/"):
-                    k = k[len(self._cfg.prefix.rstrip("/") + "/") :]
-                out.append(k)
+                out.append(k.removeprefix(self._strip_prefix))
             if resp.get("IsTruncated"):
                 token = resp.get("NextContinuationToken")
                 continue
@@ -110,8 +303,7 @@ class R2Client:
                 k = obj.get("Key")
                 if not k:
                     continue
-                if self._cfg.prefix and k.startswith(self._cfg.prefix.rstrip("/") + "/"):
-                    k = k[len(self._cfg.prefix.rstrip("/") + "/") :]
+                k = k.removeprefix(self._strip_prefix)
                 size = int(obj.get("Size", 0) or 0)
                 lm = obj.get("LastModified")
                 ts: int | None = None
@@ -3,20 +3,24 @@ from __future__ import annotations
 import datetime as dt
 import gzip
 import hashlib
+import io
+import json
 import re
+import tarfile
 import time
 from dataclasses import dataclass
 from dataclasses import field
 from email import policy
 from email.parser import BytesParser
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import threading
-from typing import Callable, Optional
+from typing import Any, Callable, Optional, cast
 
 from googleapiclient.errors import HttpError
 from botocore.exceptions import ClientError
 
-from .gmail import GmailClient
+from .gmail import AdaptiveLimiter, GmailClient
 from .models import parse_message_meta
 from .r2 import R2Client
 from .state import StateStore
@@ -41,19 +45,55 @@ def _error_summary(exc: Exception) -> str:
     return exc.__class__.__name__
 
 
-_MSGID_CLEAN = re.compile(r"^<(.+)>$")
+# Matches a Message-ID header line in the raw header block; group 1 is the
+# bracketed form, group 2 the (technically invalid but seen) bare form.
+_MSGID_RE = re.compile(rb"(?im)^Message-ID:[ \t]*(?:<([^>\r\n]+)>|([^\r\n]+?))[ \t]*$")
+
+# Raw-message object suffixes we know how to restore (see backup.COMPRESSION_SUFFIXES).
+# ".tar" is the fused layout: one object holding raw.<codec suffix> plus meta.json;
+# plain ".eml" is an uncompressed body (incompressible-payload fast path).
+_MESSAGE_SUFFIXES = (".eml.gz", ".eml.zst", ".tar", ".eml")
+
+
+def _decompress(data: bytes, suffix: str) -> bytes:
+    if suffix.endswith(".zst"):
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    if suffix.endswith(".gz"):
+        return gzip.decompress(data)
+    return data
 
 
 def _extract_message_id_header(raw_bytes: bytes) -> Optional[str]:
-    # Parse only headers; raw payload can be large.
+    # Byte-scan the header block for the one header we need; the full email
+    # parser builds a Message object and decodes every header just to read it.
+    head = raw_bytes[:32768]
+    for sep in (b"\r\n\r\n", b"\n\n"):
+        idx = head.find(sep)
+        if idx != -1:
+            head = head[:idx]
+            break
+    m = _MSGID_RE.search(head)
+    if m is None and (b"\n " in head or b"\n\t" in head):
+        # Folded header value: unfold continuation lines and retry.
+        m = _MSGID_RE.search(re.sub(rb"\r?\n[ \t]+", b" ", head))
+    if m is not None:
+        v = (m.group(1) or m.group(2) or b"").decode("ascii", "replace").strip()
+        return v or None
+    # Rare fallback (e.g. headers past the scan window): full header parse.
+    return _extract_message_id_header_slow(raw_bytes)
+
+
+def _extract_message_id_header_slow(raw_bytes: bytes) -> Optional[str]:
     msg = BytesParser(policy=policy.default).parsebytes(raw_bytes, headersonly=True)
     v = msg.get("Message-ID")
     if not v:
         return None
     v = str(v).strip()
-    m = _MSGID_CLEAN.match(v)
-    if m:
-        v = m.group(1)
+    # Nearly every Message-ID is <id@host>; plain slicing beats a regex here.
+    if len(v) >= 2 and v[0] == "<" and v[-1] == ">":
+        v = v[1:-1]
     return v or None
 
 
@@ -61,12 +101,113 @@ def _sha256(raw_bytes: bytes) -> str:
     return hashlib.sha256(raw_bytes).hexdigest()
 
 
+def _read_gzip_hashed(fileobj: Any) -> tuple[bytes, str]:
+    # Inflate in chunks and feed the hash as we go: one pass over the data
+    # instead of decompress-everything-then-hash-everything.
+    h = hashlib.sha256()
+    chunks: list[bytes] = []
+    with gzip.GzipFile(fileobj=fileobj) as gz:
+        for chunk in iter(lambda: gz.read(65536), b""):
+            h.update(chunk)
+            chunks.append(chunk)
+    return b"".join(chunks), h.hexdigest()
+
+
+class _RequestBatcher:
+    """
+    Groups per-message Gmail calls from concurrent restore workers into batch
+    endpoint calls.
+
+    A worker queues its payload and blocks on a Future; whoever fills the batch
+    executes the batch call for everyone. Workers waiting at the tail of a run
+    (when no one else will fill the batch) flush what is pending after a short
+    timeout instead of waiting forever.
+    """
+
+    _FLUSH_WAIT_S = 0.5
+
+    def __init__(self, gmail: GmailClient, batch_size: int):
+        # Own client: batch execution must not share a Resource with workers.
+        self._gmail = gmail
+        self._size = max(1, int(batch_size))
+        self._lock = threading.Lock()
+        # A timeout flush can race a full-batch flush from another worker;
+        # both would hit the shared client, which is not thread-safe.
+        self._execute_lock = threading.Lock()
+        self._pending: list[tuple[str, Any, Future[Any]]] = []
+        self._seq = 0
+
+    def _execute(self, items: list[tuple[str, Any]]) -> tuple[dict[str, Any], dict[str, Exception]]:
+        raise NotImplementedError
+
+    def _submit(self, payload: Any) -> Any:
+        fut: Future[Any] = Future()
+        with self._lock:
+            self._seq += 1
+            self._pending.append((str(self._seq), payload, fut))
+            full = len(self._pending) >= self._size
+        if full:
+            self.flush()
+        while True:
+            try:
+                return fut.result(timeout=self._FLUSH_WAIT_S)
+            except FuturesTimeoutError:
+                self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        futs = {rid: fut for rid, _, fut in pending}
+        try:
+            with self._execute_lock:
+                results, errors = self._execute([(rid, payload) for rid, payload, _ in pending])
+        except Exception as exc:
+            for fut in futs.values():
+                fut.set_exception(exc)
+            return
+        for rid, fut in futs.items():
+            if rid in results:
+                fut.set_result(results[rid])
+            else:
+                fut.set_exception(errors.get(rid, KeyError(rid)))
+
+
+class _InsertBatcher(_RequestBatcher):
+    """Batches messages.insert calls; payloads are (raw_bytes, label_ids)."""
+
+    def insert(self, raw_bytes: bytes, label_ids: list[str] | None) -> dict[str, Any]:
+        return cast(dict[str, Any], self._submit((raw_bytes, label_ids)))
+
+    def _execute(self, items: list[tuple[str, Any]]) -> tuple[dict[str, Any], dict[str, Exception]]:
+        return self._gmail.insert_messages_raw_batch([(rid, raw, labels) for rid, (raw, labels) in items])
+
+
+class _PresenceBatcher(_RequestBatcher):
+    """Batches rfc822msgid: dedupe searches; payloads are Message-ID headers."""
+
+    def is_present(self, msgid: str) -> bool:
+        return bool(self._submit(msgid))
+
+    def _execute(self, items: list[tuple[str, Any]]) -> tuple[dict[str, Any], dict[str, Exception]]:
+        return self._gmail.search_message_ids_batch([(rid, f"rfc822msgid:{msgid}") for rid, msgid in items])
+
+
 class RestoreRunner:
-    def __init__(self, *, gmail: GmailClient, r2: R2Client, state: StateStore):
+    def __init__(self, *, gmail: GmailClient, r2: R2Client, state: StateStore, insert_batch_size: int = 10):
         self._gmail = gmail
         self._r2 = r2
         self._state = state
         self._worker_local = threading.local()
+        self._suffix_by_id: dict[str, str] = {}
+        self._insert_batch_size = max(1, int(insert_batch_size))
+        self._insert_batcher: Optional[_InsertBatcher] = None
+        self._presence_batcher: Optional[_PresenceBatcher] = None
+        # Negative-lookup shortcut for claim_restore: ids known to be restored.
+        self._already_restored: set[str] = set()
+        # Re-sized to --workers per run; backs off when Gmail throttles.
+        self._gmail_limiter = AdaptiveLimiter(1)
 
     def _gmail_worker(self) -> GmailClient:
         c = getattr(self._worker_local, "gmail", None)
@@ -76,32 +217,89 @@ class RestoreRunner:
         return c
 
     def _iter_backed_up_message_ids(self) -> list[str]:
-        # Each message has messages/<id>.eml.gz and messages/<id>.json
+        # Each message has messages/<id>.eml.gz (or .eml.zst) and messages/<id>.json
         keys = self._r2.list_keys("messages/")
-        out: list[str] = []
+        self._suffix_by_id = {}
         for k in keys:
             if not k.startswith("messages/"):
                 continue
-            if not k.endswith(".eml.gz"):
-                continue
-            base = k[len("messages/") : -len(".eml.gz")]
-            if base:
-                out.append(base)
-        out.sort()
-        return out
+            for suffix in _MESSAGE_SUFFIXES:
+                if k.endswith(suffix):
+                    base = k[len("messages/") : -len(suffix)]
+                    if base:
+                        self._suffix_by_id[base] = suffix
+                    break
+        return sorted(self._suffix_by_id)
+
+    def _fetch_raw_and_meta(
+        self, source_id: str, suffix: str, meta_obj: Optional[dict[str, Any]] = None
+    ) -> tuple[bytes, dict[str, Any], str]:
+        """Returns (raw_bytes, meta_obj, raw_sha256)."""
+        if suffix == ".tar":
+            blob = self._r2.get_bytes(f"messages/{source_id}.tar")
+            raw_bytes: bytes | None = None
+            # Fused objects carry their own meta.json; ignore any caller copy.
+            meta_obj = {}
+            with tarfile.open(fileobj=io.BytesIO(blob), mode="r:") as tf:
+                for member in tf.getmembers():
+                    fh = tf.extractfile(member)
+                    if fh is None:
+                        continue
+                    data = fh.read()
+                    if member.name == "meta.json":
+                        try:
+                            obj = json.loads(data.decode("utf-8"))
+                            if isinstance(obj, dict):
+                                meta_obj = obj
+                        except ValueError:
+                            pass
+                    elif member.name.startswith("raw"):
+                        raw_bytes = _decompress(data, member.name)
+            if raw_bytes is None:
+                raise ValueError(f"No raw member in messages/{source_id}.tar")
+            return raw_bytes, meta_obj, _sha256(raw_bytes)
+        if suffix == ".eml.gz":
+            # Decompress while bytes arrive off the socket: skips buffering the
+            # compressed copy and overlaps download with inflate (hashing each
+            # chunk while it is still cache-hot).
+            raw_bytes, raw_hash = _read_gzip_hashed(self._r2.get_streaming_body(f"messages/{source_id}{suffix}"))
+        else:
+            raw_bytes = _decompress(self._r2.get_bytes(f"messages/{source_id}{suffix}"), suffix)
+            raw_hash = _sha256(raw_bytes)
+        if meta_obj is None:
+            meta_obj = self._r2.get_json_or_none(f"messages/{source_id}.json") or {}
+        return raw_bytes, meta_obj, raw_hash
+
+    def _insert_raw(self, raw_bytes: bytes, label_ids: list[str] | None) -> dict[str, Any]:
+        with self._gmail_limiter:
+            if self._insert_batcher is not None:
+                return self._insert_batcher.insert(raw_bytes, label_ids)
+            return self._gmail_worker().insert_message_raw(
+                raw_bytes,
+                label_ids=label_ids,
+                internal_date_source="dateHeader",
+            )
 
     def _is_present_in_gmail_by_msgid(self, msgid: str) -> bool:
         # Gmail search operator: rfc822msgid:
         # This is the best available stable dedupe key for restores.
-        q = f"rfc822msgid:{msgid}"
-        for _mid in self._gmail_worker().search_message_ids(q=q, max_results=1):
-            return True
-        return False
-
-    def _restore_one(self, source_id: str, *, apply: bool) -> tuple[str | None, str | None, str | None, bool]:
+        with self._gmail_limiter:
+            if self._presence_batcher is not None:
+                return self._presence_batcher.is_present(msgid)
+            q = f"rfc822msgid:{msgid}"
+            for _mid in self._gmail_worker().search_message_ids(q=q, max_results=1):
+                return True
+            return False
+
+    def _restore_one(
+        self, source_id: str, *, apply: bool, meta_obj: Optional[dict[str, Any]] = None
+    ) -> tuple[str | None, str | None, str | None, bool]:
         """
         Returns (restored_message_id, message_id_header, raw_sha256, did_restore)
         """
+        if source_id in self._already_restored:
+            return None, None, None, False
+
         # Cross-machine idempotency: if there's a restore marker in R2, trust it.
         marker_key = f"state/restore/{source_id}.json"
         marker = self._r2.get_json_or_none(marker_key)
@@ -116,22 +314,20 @@ class RestoreRunner:
                     message_id_header=msgid,
                     raw_sha256=raw_hash,
                 )
+                self._already_restored.add(source_id)
             except (TypeError, ValueError, KeyError):
                 # Marker is untrusted input; ignore and proceed with normal restore checks.
                 pass
             return None, None, None, False
 
-        if self._state.was_restored(source_id):
-            return None, None, None, False
+        # claim_restore re-checks the restored table transactionally, so the
+        # in-memory prefilter above is the only point lookup we skip here.
         if not self._state.claim_restore(source_id):
             return None, None, None, False
 
         try:
-            raw_gz = self._r2.get_bytes(f"messages/{source_id}.eml.gz")
-            raw_bytes = gzip.decompress(raw_gz)
-            raw_hash = _sha256(raw_bytes)
-
-            meta_obj = self._r2.get_json_or_none(f"messages/{source_id}.json") or {}
+            suffix = self._suffix_by_id.get(source_id, ".eml.gz")
+            raw_bytes, meta_obj, raw_hash = self._fetch_raw_and_meta(source_id, suffix, meta_obj)
             meta = parse_message_meta(meta_obj)
             label_ids = meta.label_ids()
 
@@ -143,6 +339,7 @@ class RestoreRunner:
                     message_id_header=msgid,
                     raw_sha256=raw_hash,
                 )
+                self._already_restored.add(source_id)
                 if apply:
                     self._r2.put_json(
                         marker_key,
@@ -161,40 +358,27 @@ class RestoreRunner:
 
             restored_id: str | None = None
             try:
-                inserted = self._gmail_worker().insert_message_raw(
-                    raw_bytes,
-                    label_ids=label_ids or None,
-                    internal_date_source="dateHeader",
-                )
+                inserted = self._insert_raw(raw_bytes, label_ids or None)
                 restored_id = inserted.get("id")
             except HttpError as e:
                 # Some system labels can cause insert failures. Retry without labelIds,
                 # then re-apply what we can via modify/trash.
                 if getattr(getattr(e, "resp", None), "status", None) not in (400, 403):
                     raise
-                inserted = self._gmail_worker().insert_message_raw(
-                    raw_bytes,
-                    label_ids=None,
-                    internal_date_source="dateHeader",
-                )
+                inserted = self._insert_raw(raw_bytes, None)
                 restored_id = inserted.get("id")
 
             if restored_id:
-                # Best-effort re-apply labels and special locations.
+                # Best-effort re-apply labels and special locations, batched
+                # into one round trip (SPAM is just another label in the add
+                # list; TRASH needs its own trash() sub-request).
                 # Note: Some system labels may be restricted; failures are ignored per "skip silently".
                 try:
-                    if label_ids:
-                        self._gmail_worker().modify_labels(restored_id, add=label_ids)
-                except (HttpError, ClientError):
-                    pass
-                try:
-                    if "TRASH" in (label_ids or []):
-                        self._gmail_worker().trash(restored_id)
-                except (HttpError, ClientError):
-                    pass
-                try:
-                    if "SPAM" in (label_ids or []):
-                        self._gmail_worker().modify_labels(restored_id, add=["SPAM"])
+                    self._gmail_worker().modify_and_trash(
+                        restored_id,
+                        add=label_ids or None,
+                        trash="TRASH" in (label_ids or []),
+                    )
                 except (HttpError, ClientError):
                     pass
 
@@ -204,6 +388,7 @@ class RestoreRunner:
                 message_id_header=msgid,
                 raw_sha256=raw_hash,
             )
+            self._already_restored.add(source_id)
             if apply:
                 self._r2.put_json(
                     marker_key,
@@ -231,6 +416,27 @@ class RestoreRunner:
         on_progress: Optional[Callable[[int, RestoreStats, float], None]] = None,
     ) -> RestoreStats:
         stats = RestoreStats()
+        self._gmail_limiter = AdaptiveLimiter(int(workers))
+        self._already_restored = self._state.restored_ids()
+        # Only `workers` submissions can ever be pending at once (each worker
+        # blocks after queueing), so cap the batch at the worker count: the
+        # last worker to queue fills the batch and flushes immediately instead
+        # of everyone sitting out the flush timeout. With one worker a batch
+        # can never fill, so batching is skipped entirely.
+        insert_batch = min(self._insert_batch_size, int(workers))
+        self._insert_batcher = (
+            _InsertBatcher(self._gmail.clone(), insert_batch)
+            if apply and insert_batch > 1
+            else None
+        )
+        # Presence checks also run on dry runs; the batch is sized by the
+        # worker count for the same reason as above — only that many checks
+        # can ever be pending, whatever the insert batch size is.
+        self._presence_batcher = (
+            _PresenceBatcher(self._gmail.clone(), int(workers))
+            if int(workers) > 1
+            else None
+        )
         ids = self._iter_backed_up_message_ids()
         started = time.monotonic()
         last_report_n = 0
@@ -241,13 +447,23 @@ class RestoreRunner:
             if len(stats.error_samples) < max_error_samples:
                 stats.error_samples.append(f"{source_id}: {_error_summary(exc)}")
 
+        # Metadata fetched while applying --since is reused by _restore_one so
+        # filtered runs don't GET each <id>.json twice.
+        meta_by_id: dict[str, dict[str, Any]] = {}
+
         def _filter_ids() -> list[str]:
             out: list[str] = []
             for source_id in ids:
                 if max_messages and len(out) >= max_messages:
                     break
-                if since:
+                # Known-restored ids get skipped cheaply in _restore_one; don't
+                # spend a meta GET filtering them.
+                if since and source_id not in self._already_restored:
+                    # Best-effort: fused .tar backups have no standalone meta object,
+                    # so they pass through the --since filter unfiltered.
                     meta_obj = self._r2.get_json_or_none(f"messages/{source_id}.json") or {}
+                    if self._suffix_by_id.get(source_id) != ".tar":
+                        meta_by_id[source_id] = meta_obj
                     meta = parse_message_meta(meta_obj)
                     try:
                         if meta.internalDate:
@@ -266,7 +482,9 @@ class RestoreRunner:
             for source_id in work_ids:
                 stats.considered += 1
                 try:
-                    _restored_id, _msgid, _raw_hash, did_restore = self._restore_one(source_id, apply=apply)
+                    _restored_id, _msgid, _raw_hash, did_restore = self._restore_one(
+                        source_id, apply=apply, meta_obj=meta_by_id.get(source_id)
+                    )
                     if did_restore:
                         stats.restored += 1
                     else:
@@ -281,7 +499,10 @@ class RestoreRunner:
                         on_progress(n, stats, time.monotonic() - started)
         else:
             with ThreadPoolExecutor(max_workers=int(workers)) as ex:
-                futs = {ex.submit(self._restore_one, sid, apply=apply): sid for sid in work_ids}
+                futs = {
+                    ex.submit(self._restore_one, sid, apply=apply, meta_obj=meta_by_id.get(sid)): sid
+                    for sid in work_ids
+                }
                 for fut in as_completed(futs):
                     source_id = futs[fut]
                     stats.considered += 1
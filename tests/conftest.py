@@ -2,9 +2,17 @@ from __future__ import annotations
 
 import pytest
 
+from gmail_r2_backup.config import reset_env_cache
 from gmail_r2_backup.state import StateStore
 
 
+@pytest.fixture(autouse=True)
+def _fresh_r2_env() -> None:
+    # The R2 env snapshot is cached per process; tests mutate os.environ,
+    # so drop the cache before each test.
+    reset_env_cache()
+
+
 @pytest.fixture()
 def state_store(tmp_path) -> StateStore:
     return StateStore(str(tmp_path / "state"))
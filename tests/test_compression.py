@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import gzip
+
+import zstandard
+
+import os
+
+from gmail_r2_backup.backup import COMPRESSION_SUFFIXES, _probably_incompressible
+from gmail_r2_backup.restore import _MESSAGE_SUFFIXES, _decompress
+
+
+def test_decompress_gzip_roundtrip() -> None:
+    raw = b"From: a@example.com\r\n\r\nBody"
+    assert _decompress(gzip.compress(raw), ".eml.gz") == raw
+
+
+def test_decompress_zstd_roundtrip() -> None:
+    raw = b"From: a@example.com\r\n\r\nBody"
+    assert _decompress(zstandard.ZstdCompressor(level=3).compress(raw), ".eml.zst") == raw
+
+
+def test_restore_knows_all_backup_suffixes() -> None:
+    # Every suffix the backup can write must be restorable.
+    assert set(COMPRESSION_SUFFIXES.values()) <= set(_MESSAGE_SUFFIXES)
+
+
+def test_decompress_plain_eml_passthrough() -> None:
+    raw = b"From: a@example.com\r\n\r\nBody"
+    assert _decompress(raw, ".eml") == raw
+
+
+def test_probably_incompressible() -> None:
+    assert _probably_incompressible(os.urandom(8192)) is True
+    assert _probably_incompressible(b"From: a@example.com\r\n\r\n" + b"hello " * 2000) is False
+    # Tiny bodies aren't worth probing.
+    assert _probably_incompressible(b"short") is False
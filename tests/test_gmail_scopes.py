@@ -66,3 +66,38 @@ def test_from_stored_token_errors_if_required_scope_missing(monkeypatch, state_s
             state_store, scopes=[gmail_mod.GmailClient.SCOPE_INSERT, gmail_mod.GmailClient.SCOPE_MODIFY]
         )
 
+
+
+def test_adaptive_limiter_halves_on_throttle_and_ramps_back() -> None:
+    limiter = gmail_mod.AdaptiveLimiter(8)
+    assert limiter._permits == 8  # noqa: SLF001
+
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter._permits == 4  # noqa: SLF001
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter._permits == 2  # noqa: SLF001
+
+    for _ in range(gmail_mod.AdaptiveLimiter.RAMP_SUCCESSES):
+        limiter.acquire()
+        limiter.release()
+    assert limiter._permits == 3  # noqa: SLF001
+
+
+def test_adaptive_limiter_never_drops_below_one_permit() -> None:
+    limiter = gmail_mod.AdaptiveLimiter(1)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter._permits == 1  # noqa: SLF001
+
+
+def test_retry_after_seconds_parses_numeric_header() -> None:
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    err = HttpError(resp=httplib2.Response({"status": "429", "retry-after": "7"}), content=b"")
+    assert gmail_mod.GmailClient._retry_after_seconds(err) == 7.0  # noqa: SLF001
+
+    err = HttpError(resp=httplib2.Response({"status": "429"}), content=b"")
+    assert gmail_mod.GmailClient._retry_after_seconds(err) is None  # noqa: SLF001
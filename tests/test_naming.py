@@ -10,3 +10,14 @@ def test_r2_prefix_from_email_basic() -> None:
 def test_r2_prefix_from_email_empty() -> None:
     assert r2_prefix_from_email("") == "gmail-backup/gmail"
 
+
+
+def test_message_key_match_extracts_ids() -> None:
+    from gmail_r2_backup.naming import message_key_match
+
+    assert message_key_match("messages/x.eml.gz").group(1) == "x"
+    assert message_key_match("messages/a.b.tar").group(1) == "a.b"
+    assert message_key_match("messages/y.eml.zst").group(1) == "y"
+    assert message_key_match("messages/z.eml").group(1) == "z"
+    assert message_key_match("messages/x.json") is None
+    assert message_key_match("messages/.eml") is None
@@ -1,6 +1,12 @@
 from __future__ import annotations
 
-from gmail_r2_backup.restore import _extract_message_id_header
+import gzip
+import hashlib
+import io
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+from gmail_r2_backup.restore import RestoreRunner, _InsertBatcher, _PresenceBatcher, _extract_message_id_header
 
 
 def test_extract_message_id_header() -> None:
@@ -17,3 +23,79 @@ def test_extract_message_id_header_missing() -> None:
     raw = b"From: a@example.com\r\nSubject: hi\r\n\r\nBody"
     assert _extract_message_id_header(raw) is None
 
+
+def test_extract_message_id_header_folded() -> None:
+    raw = b"From: a@example.com\r\nMessage-ID:\r\n <abc123@example.com>\r\n\r\nBody"
+    assert _extract_message_id_header(raw) == "abc123@example.com"
+
+
+def test_extract_message_id_header_ignores_body_lines() -> None:
+    raw = b"From: a@example.com\r\n\r\nMessage-ID: <not-a-header@example.com>\r\n"
+    assert _extract_message_id_header(raw) is None
+
+
+def test_fetch_raw_and_meta_from_fused_tar(state_store) -> None:
+    raw = b"From: a@example.com\r\n\r\nBody"
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tf:
+        for name, data in [("raw.eml.gz", gzip.compress(raw)), ("meta.json", b'{"id": "m1", "labelIds": ["INBOX"]}')]:
+            info = tarfile.TarInfo(name=name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+    class _TarR2:
+        def get_bytes(self, key: str) -> bytes:
+            assert key == "messages/m1.tar"
+            return buf.getvalue()
+
+    runner = RestoreRunner(gmail=None, r2=_TarR2(), state=state_store)  # type: ignore[arg-type]
+    raw_bytes, meta_obj, raw_hash = runner._fetch_raw_and_meta("m1", ".tar")  # noqa: SLF001
+    assert raw_bytes == raw
+    assert meta_obj == {"id": "m1", "labelIds": ["INBOX"]}
+    assert raw_hash == hashlib.sha256(raw).hexdigest()
+
+
+def test_insert_batcher_groups_concurrent_inserts() -> None:
+    class _FakeGmail:
+        def __init__(self) -> None:
+            self.calls: list[int] = []
+
+        def insert_messages_raw_batch(self, items):  # type: ignore[no-untyped-def]
+            self.calls.append(len(items))
+            return {rid: {"id": f"g-{rid}"} for rid, _raw, _labels in items}, {}
+
+    gmail = _FakeGmail()
+    batcher = _InsertBatcher(gmail, batch_size=2)  # type: ignore[arg-type]
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futs = [ex.submit(batcher.insert, b"raw", None) for _ in range(2)]
+        results = [f.result(timeout=10) for f in futs]
+    assert sorted(r["id"] for r in results) == ["g-1", "g-2"]
+    # Both inserts shared one batch call.
+    assert gmail.calls == [2]
+
+
+def test_insert_batcher_flushes_partial_batch_on_timeout() -> None:
+    class _FakeGmail:
+        def insert_messages_raw_batch(self, items):  # type: ignore[no-untyped-def]
+            return {rid: {"id": f"g-{rid}"} for rid, _raw, _labels in items}, {}
+
+    batcher = _InsertBatcher(_FakeGmail(), batch_size=10)  # type: ignore[arg-type]
+    # A lone insert must not wait forever for a batch that will never fill.
+    assert batcher.insert(b"raw", ["INBOX"])["id"] == "g-1"
+
+
+def test_presence_batcher_maps_per_message_results() -> None:
+    class _FakeGmail:
+        def __init__(self) -> None:
+            self.queries: list[str] = []
+
+        def search_message_ids_batch(self, queries):  # type: ignore[no-untyped-def]
+            self.queries.extend(q for _rid, q in queries)
+            return {rid: q.endswith("present@example.com") for rid, q in queries}, {}
+
+    gmail = _FakeGmail()
+    batcher = _PresenceBatcher(gmail, batch_size=1)  # type: ignore[arg-type]
+    assert batcher.is_present("present@example.com") is True
+    assert batcher.is_present("missing@example.com") is False
+    assert gmail.queries == ["rfc822msgid:present@example.com", "rfc822msgid:missing@example.com"]
+
@@ -24,6 +24,17 @@ def test_claim_upload_reclaims_when_stale(state_store, monkeypatch) -> None:
     assert state_store.claim_upload("m1", stale_after_s=3600) is True
 
 
+def test_bulk_claim_upload_returns_only_won_ids(state_store, monkeypatch) -> None:
+    monkeypatch.setattr(state_mod.time, "time", lambda: 1000)
+
+    state_store.mark_uploaded("m1")
+    assert state_store.claim_upload("m2") is True
+
+    assert state_store.bulk_claim_upload(["m1", "m2", "m3"]) == ["m3"]
+    # Everything claimed or uploaded now; a second pass wins nothing.
+    assert state_store.bulk_claim_upload(["m1", "m2", "m3"]) == []
+
+
 def test_claim_restore_idempotent(state_store, monkeypatch) -> None:
     monkeypatch.setattr(state_mod.time, "time", lambda: 1000)
 
@@ -34,6 +45,22 @@ def test_claim_restore_idempotent(state_store, monkeypatch) -> None:
     assert state_store.claim_restore("s1") is False
 
 
+def test_append_log_replays_over_state_and_folds_on_write(state_store) -> None:
+    state_store.write_state({"historyId": "100"})
+    state_store.append_log({"historyId": "101"})
+    state_store.append_log({"historyId": "102", "extra": True})
+
+    st = state_store.read_state()
+    assert st["historyId"] == "102"
+    assert st["extra"] is True
+
+    # write_state folds the log into state.json and truncates it.
+    state_store.write_state({"lastRunAt": 1})
+    st = state_store.read_state()
+    assert st["historyId"] == "102"
+    assert st["lastRunAt"] == 1
+
+
 def test_uploaded_count_and_has_uploaded_any(state_store) -> None:
     assert state_store.uploaded_count() == 0
     assert state_store.has_uploaded_any() is False
@@ -52,3 +79,81 @@ def test_bulk_mark_uploaded_inserts_and_is_idempotent(state_store, monkeypatch)
     # Idempotent: re-inserting existing ids should not change count.
     state_store.bulk_mark_uploaded([("m2", 333), ("m3", 444)])
     assert state_store.uploaded_count() == 3
+
+    # Accepts a lazy iterable, not just a list.
+    state_store.bulk_mark_uploaded((f"g{i}", 555) for i in range(3))
+    assert state_store.uploaded_count() == 6
+
+
+def test_finalize_uploads_marks_and_releases_claims(state_store) -> None:
+    assert state_store.claim_upload("m1") is True
+    assert state_store.claim_upload("m2") is True
+
+    # m1 succeeded, m2 failed; both claims are released either way.
+    state_store.finalize_uploads([("m1", 111)], ["m1", "m2"])
+
+    assert state_store.was_uploaded("m1") is True
+    assert state_store.was_uploaded("m2") is False
+    assert state_store.claim_upload("m2") is True
+
+
+def test_bulk_mark_restored_upserts(state_store) -> None:
+    state_store.bulk_mark_restored([("s1", "r1", "msgid-1", None), ("s2", None, None, None)])
+    assert state_store.was_restored("s1") is True
+    assert state_store.was_restored("s2") is True
+    assert state_store.restored_count() == 2
+
+    # Re-marking updates in place instead of duplicating rows.
+    state_store.bulk_mark_restored([("s1", "r1b", "msgid-1", "hash")])
+    assert state_store.restored_count() == 2
+
+
+def test_init_db_migrates_legacy_rowid_tables(tmp_path) -> None:
+    import sqlite3
+
+    root = tmp_path / "state"
+    root.mkdir()
+    con = sqlite3.connect(root / "index.sqlite3")
+    con.execute("create table messages (id text primary key, uploaded_at integer not null)")
+    con.execute("insert into messages values ('m1', 111)")
+    con.commit()
+    con.close()
+
+    store = state_mod.StateStore(str(root))
+    assert store.was_uploaded("m1") is True
+    con = sqlite3.connect(root / "index.sqlite3")
+    sql = con.execute("select sql from sqlite_master where name = 'messages'").fetchone()[0]
+    con.close()
+    assert "without rowid" in sql.lower()
+
+
+def test_close_is_idempotent_and_store_reopens_lazily(state_store) -> None:
+    with state_store as s:
+        s.mark_uploaded("m1")
+    state_store.close()
+    # A closed store reopens its per-thread connection on next use.
+    assert state_store.was_uploaded("m1") is True
+
+
+def test_init_db_stamps_schema_version(state_store) -> None:
+    import os
+    import sqlite3
+
+    con = sqlite3.connect(os.path.join(state_store.root_dir, "index.sqlite3"))
+    version = con.execute("pragma user_version").fetchone()[0]
+    con.close()
+    assert version == state_mod._SCHEMA_VERSION
+
+    # Reopening the same state dir (DDL skipped) must still yield a working store.
+    again = state_mod.StateStore(state_store.root_dir)
+    again.mark_uploaded("m1")
+    assert again.was_uploaded("m1") is True
+
+
+def test_restored_ids_returns_source_ids(state_store) -> None:
+    assert state_store.restored_ids() == set()
+    state_store.mark_restored(
+        source_message_id="s1", restored_message_id="r1", message_id_header=None, raw_sha256=None
+    )
+    state_store.bulk_mark_restored([("s2", None, None, None)])
+    assert state_store.restored_ids() == {"s1", "s2"}